@@ -1,127 +1,399 @@
+import hashlib
+import json
 import os
+import shutil
 import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
 
+from arrest_cube import VIOLENT_CRIMES, build_cube, save_cube
+from crosswalk import build_crosswalk, impute_fips, normalize_fips, save_crosswalk
+from dates import month_starts
+from instrument import instrumented, stage
+from schema import arrest_schema, concat, month_categories
 
-def load_data():
-    """
 
-    :return:
+DATA_PATH = "../00_source_data"
+ARREST_DATA = os.path.join(
+    DATA_PATH, "ucr_arrests_monthly_all" "_crimes_race_sex_1974_2020_dta.zip"
+)
+AGENCIES = os.path.join(DATA_PATH, "Crime data", "agencies.csv")
+ARREST_MEMBER = "ucr_arrests_monthly_all_crimes_race_sex_{year}.dta"
+ARREST_CACHE = "../20_intermediate_files/arrest_cache"
+ARREST_CUBE = "../20_intermediate_files/arrest_cube"
+
+
+@instrumented()
+def read_arrest_member(zip_file, member, states=None, columns=None, chunksize=100_000):
+    """
+    Stream one Stata member of the arrest zip, keeping only the requested
+    columns and the rows of the requested states, with the compact dtypes
+    of arrest_schema.
+
+    :param zip_file: an open ZipFile
+    :param member: name of the .dta member inside the zip
+    :param states: state abbreviations to keep, None keeps every state
+    :param columns: columns to keep, None keeps every column
+    :param chunksize: number of rows decoded per chunk
+    :return: the filtered data frame
+    """
+    read_cols = None
+    if columns is not None:
+        read_cols = list(columns)
+        if states is not None and "state_abb" not in read_cols:
+            read_cols.append("state_abb")
+
+    chunks = []
+    with pd.read_stata(
+        zip_file.open(member), columns=read_cols, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            if states is not None:
+                chunk = chunk[chunk["state_abb"].isin(states)]
+            if columns is not None:
+                chunk = chunk[list(columns)]
+            chunks.append(chunk)
+
+    return arrest_schema(pd.concat(chunks, axis=0, ignore_index=True))
+
+
+@instrumented()
+def load_data(
+    path=None, years=(2019, 2020), states=None, columns=None, chunksize=100_000
+):
     """
-    with ZipFile(ARREST_DATA) as zip_file:
-        dfs = {
-            text_file.filename: pd.read_stata(zip_file.open(text_file.filename))
-            for text_file in zip_file.infolist()
-            if text_file.filename.endswith(".dta")
-        }
+    Only the zip members of the requested years are opened, and each of them
+    is decoded chunk by chunk, so peak memory follows the size of the output
+    slice rather than the size of the archive.
+
+    :param path: path of the arrest zip, defaults to ARREST_DATA
+    :param years: years to load
+    :param states: state abbreviations to keep, None keeps every state
+    :param columns: columns to keep, None keeps every column
+    :param chunksize: number of rows decoded per chunk
+    :return: one data frame per requested year, in the order of years
+    """
+    path = ARREST_DATA if path is None else path
+    with ZipFile(path) as zip_file:
+        members = set(zip_file.namelist())
+        dfs = []
+        for year in years:
+            member = ARREST_MEMBER.format(year=year)
+            if member not in members:
+                raise ValueError(f"{member} is not in {path}")
+            dfs.append(read_arrest_member(zip_file, member, states, columns, chunksize))
 
-    a_2019 = dfs["ucr_arrests_monthly_all_crimes_race_sex_2019.dta"].copy()
-    a_2020 = dfs["ucr_arrests_monthly_all_crimes_race_sex_2020.dta"].copy()
+    return tuple(dfs)
 
-    return a_2019, a_2020
 
+def archive_hash(path, cache_dir=ARREST_CACHE):
+    """
+    SHA-256 of the archive contents. The digest is remembered next to the
+    cache together with the file size and mtime, so an unchanged archive is
+    only read once.
 
-def match_columns(df1, df2):
+    :param path: path of the archive
+    :param cache_dir: cache directory
+    :return: hex digest
+    """
+    stat = os.stat(path)
+    index_file = os.path.join(cache_dir, "archives.json")
+    key = os.path.abspath(path)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+    entry = index.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    index[key] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_file, "w") as f:
+        json.dump(index, f, indent=2)
+    return digest.hexdigest()
+
+
+def _state_file(member_dir, state):
+    return os.path.join(member_dir, f"state_abb={state or '__blank__'}.parquet")
+
+
+@instrumented()
+def cache_member(zip_file, member, member_dir, chunksize=100_000):
     """
+    Decode one zip member and store it as one Parquet file per state. The
+    files are written to a temporary directory first, so an interrupted run
+    never leaves a partial member behind.
+
+    :param zip_file: an open ZipFile
+    :param member: name of the .dta member inside the zip
+    :param member_dir: cache directory of the member
+    :param chunksize: number of rows decoded per chunk
+    """
+    tmp_dir = member_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    df = read_arrest_member(zip_file, member, chunksize=chunksize)
+    for state, part in df.groupby("state_abb", sort=False, observed=True):
+        part.to_parquet(_state_file(tmp_dir, state), index=False)
+    os.replace(tmp_dir, member_dir)
 
-    :param df1:
-    :param df2:
-    :return:
+
+def read_cached_member(member_dir, states=None, columns=None):
+    """
+    Read a cached member, opening only the files of the requested states
+    and only the requested columns.
+
+    :param member_dir: cache directory of the member
+    :param states: state abbreviations to keep, None keeps every state
+    :param columns: columns to keep, None keeps every column
+    :return: the filtered data frame
     """
-    df1_cols = set(df1.columns)
-    df2_cols = set(df2.columns)
-
-    if len(df1_cols) > len(df2_cols):
-        cols_remove = list(df1_cols.difference(df2_cols))
-        return df1.drop(cols_remove, axis=1), df2
-    elif len(df1_cols) < len(df2_cols):
-        cols_remove = list(df2_cols.difference(df1_cols))
-        return df1, df2.drop(cols_remove, axis=1)
-    elif df1_cols == df2_cols:
-        return df1, df2
+    if states is None:
+        files = sorted(
+            os.path.join(member_dir, name)
+            for name in os.listdir(member_dir)
+            if name.endswith(".parquet")
+        )
     else:
-        raise ValueError("Take a look! The dataframes are out of shape!")
+        files = [_state_file(member_dir, state) for state in states]
+        files = [file for file in files if os.path.exists(file)]
+
+    if not files:
+        # Nothing cached for these states, return the right columns anyway
+        schema_file = next(
+            name for name in os.listdir(member_dir) if name.endswith(".parquet")
+        )
+        empty = pd.read_parquet(os.path.join(member_dir, schema_file), columns=columns)
+        return arrest_schema(empty.iloc[0:0].copy())
+
+    # The Parquet files keep the categoricals, arrest_schema only converts
+    # members cached before it existed
+    return arrest_schema(
+        concat(
+            [pd.read_parquet(file, columns=columns) for file in files],
+            axis=0,
+            ignore_index=True,
+        )
+    )
 
 
-def filter_by_state_concat(df1, df2, state="CO"):
+@instrumented()
+def load_data_cached(
+    path=None,
+    years=(2019, 2020),
+    states=None,
+    columns=None,
+    cache_dir=ARREST_CACHE,
+    chunksize=100_000,
+):
+    """
+    Same as load_data, but every year is decoded from Stata only once and
+    kept as Parquet under cache_dir/<archive sha256>/<member>/, one file per
+    state. A changed archive gets a new hash, and the entries of the old one
+    are removed.
+
+    :param path: path of the arrest zip, defaults to ARREST_DATA
+    :param years: years to load
+    :param states: state abbreviations to keep, None keeps every state
+    :param columns: columns to keep, None keeps every column
+    :param cache_dir: cache directory
+    :param chunksize: number of rows decoded per chunk on a cache miss
+    :return: one data frame per requested year, in the order of years
     """
+    path = ARREST_DATA if path is None else path
+    digest = archive_hash(path, cache_dir)
+    archive_dir = os.path.join(cache_dir, digest)
+
+    # Drop entries written for previous versions of the archive
+    for name in os.listdir(cache_dir):
+        stale = os.path.join(cache_dir, name)
+        if os.path.isdir(stale) and name != digest:
+            shutil.rmtree(stale)
+
+    members = [ARREST_MEMBER.format(year=year) for year in years]
+    missing = [
+        member
+        for member in members
+        if not os.path.isdir(os.path.join(archive_dir, member))
+    ]
+    if missing:
+        os.makedirs(archive_dir, exist_ok=True)
+        with ZipFile(path) as zip_file:
+            names = set(zip_file.namelist())
+            for member in missing:
+                if member not in names:
+                    raise ValueError(f"{member} is not in {path}")
+                cache_member(
+                    zip_file, member, os.path.join(archive_dir, member), chunksize
+                )
+
+    return tuple(
+        read_cached_member(os.path.join(archive_dir, member), states, columns)
+        for member in members
+    )
 
-    :return:
+
+def match_columns(*dfs, how="intersection"):
+    """
+    Give every data frame the same columns, in the order of the first one.
+
+    :param dfs: data frames to reconcile
+    :param how: "intersection" keeps the columns shared by all frames,
+        "union" keeps every column and fills the missing ones with NaN
+    :return: the reconciled data frames, in the same order
     """
-    df1 = df1.query(f"state_abb == '{state}'")
-    df2 = df2.query(f"state_abb == '{state}'")
-    return pd.concat([df1, df2], axis=0)
+    if how == "intersection":
+        shared = set.intersection(*(set(df.columns) for df in dfs))
+        cols = [col for col in dfs[0].columns if col in shared]
+        if not cols:
+            raise ValueError("Take a look! The dataframes share no columns!")
+        return tuple(df[cols] for df in dfs)
+    elif how == "union":
+        cols = list(dict.fromkeys(col for df in dfs for col in df.columns))
+        return tuple(df.reindex(columns=cols) for df in dfs)
+    else:
+        raise ValueError(f"how must be 'intersection' or 'union', got {how!r}")
 
 
-def filter_columns(col_type: str, df):
+def filter_by_state_concat(*dfs, state="CO"):
     """
 
-    :return:
+    :param dfs: data frames to filter
+    :param state: a state abbreviation or a list of them
+    :return: the rows of the requested states, concatenated
     """
-    violent_crime_c = [
-        "agg_assault_tot",
-        "arson_tot",
-        "burglary_tot",
-        "manslaught_neg_tot",
-        "murder_tot",
-        "oth_assault_tot",
-        "oth_sex_off_tot",
-        "rape_tot",
-        "robbery_tot",
-    ]
-    cols = [col for col in df.columns if col.endswith("tot_" + col_type)]
-    violent_s = [i + "_" + col_type for i in violent_crime_c]
-    non_violent_columns = list(set(cols).difference(set(violent_s)))
-    return non_violent_columns
+    states = [state] if isinstance(state, str) else list(state)
+    return concat([df[df["state_abb"].isin(states)] for df in dfs], axis=0)
+
+
+def _load_year(path, year, states, columns, chunksize, cache_dir):
+    # Worker for load_arrests_parallel, runs in its own process
+    if cache_dir is None:
+        return load_data(path, (year,), states, columns, chunksize)[0]
+    return load_data_cached(path, (year,), states, columns, cache_dir, chunksize)[0]
+
+
+@instrumented()
+def load_arrests_parallel(
+    path=None,
+    years=(2019, 2020),
+    states=None,
+    columns=None,
+    how="intersection",
+    cache_dir=None,
+    max_workers=None,
+    chunksize=100_000,
+):
+    """
+    Decode every requested year in its own worker process, reconcile the
+    yearly schemas with match_columns and concatenate the result.
+
+    :param path: path of the arrest zip, defaults to ARREST_DATA
+    :param years: years to load
+    :param states: state abbreviations to keep, None keeps every state
+    :param columns: columns to keep, None keeps every column
+    :param how: column policy passed to match_columns
+    :param cache_dir: read through the Parquet cache in this directory,
+        None decodes the Stata files directly
+    :param max_workers: number of processes, defaults to one per year
+        up to the number of cores
+    :param chunksize: number of rows decoded per chunk
+    :return: one data frame holding all requested years and states
+    """
+    path = ARREST_DATA if path is None else path
+    years = list(years)
+    if cache_dir is not None:
+        # Hash once up front so the workers only ever read the index
+        archive_hash(path, cache_dir)
+    if max_workers is None:
+        max_workers = min(len(years), os.cpu_count() or 1)
 
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _load_year, path, year, states, columns, chunksize, cache_dir
+            )
+            for year in years
+        ]
+        dfs = [future.result() for future in futures]
 
-def data_with_relevant_columns(df):
-    all_cols = df.columns.to_list()
-    general_cols = all_cols[:14]
-    categories = ["arrests", "black", "white", "asian", "male", "female", "amer_ind"]
-    relevant_cols = general_cols
-    for cat in categories:
-        col = filter_columns(cat, df)
-        relevant_cols += col
-    return df[relevant_cols]
+    return concat(match_columns(*dfs, how=how), axis=0, ignore_index=True)
 
 
-## Specific for violent arrests
-def filter_columns_violent(col_type: str, df):
+DEMOGRAPHICS = ["arrests", "black", "white", "asian", "amer_ind", "male", "female"]
+
+
+def offense_names(df, demographics=DEMOGRAPHICS):
     """
-    :return:
+    Offense prefixes (e.g. "theft_tot") of the per-demographic count columns.
+
+    :param df: arrest data
+    :param demographics: demographic suffixes to look for
+    :return: list of offense names, in column order
     """
-    violent_crime_c = [
-        "agg_assault_tot",
-        "arson_tot",
-        "burglary_tot",
-        "manslaught_neg_tot",
-        "murder_tot",
-        "oth_assault_tot",
-        "oth_sex_off_tot",
-        "rape_tot",
-        "robbery_tot",
+    names = {}
+    for col in df.columns:
+        for demo in demographics:
+            if col.endswith("tot_" + demo):
+                names[col[: -len(demo) - 1]] = None
+    return list(names)
+
+
+def non_violent_offenses(df, demographics=DEMOGRAPHICS):
+    """
+
+    :param df: arrest data
+    :param demographics: demographic suffixes to look for
+    :return: every offense of df that is not in VIOLENT_CRIMES
+    """
+    return [
+        name for name in offense_names(df, demographics) if name not in VIOLENT_CRIMES
     ]
-    cols = [col for col in df.columns if col.endswith("tot_" + col_type)]
-    violent_s = [i + "_" + col_type for i in violent_crime_c]
-    non_violent_columns = list(set(cols).difference(set(violent_s)))
-    return violent_s
 
 
-## Specific for violent arrests
-def data_with_relevant_columns_violent(df):
-    all_cols = df.columns.to_list()
-    general_cols = all_cols[:14]
-    categories = ["arrests", "black", "white", "asian", "male", "female", "amer_ind"]
-    relevant_cols = general_cols
-    for cat in categories:
-        col = filter_columns_violent(cat, df)
-        relevant_cols += col
-    return df[relevant_cols]
+def filter_columns(col_type: str, df, offenses):
+    """
+
+    :param col_type: demographic suffix, e.g. "black"
+    :param df: arrest data
+    :param offenses: offense names of the crime grouping
+    :return: the count columns of df for these offenses and this demographic
+    """
+    cols = [name + "_" + col_type for name in offenses]
+    return [col for col in cols if col in df.columns]
 
 
+def column_index(df, demographics=DEMOGRAPHICS):
+    """
+
+    :param df: arrest data
+    :param demographics: demographic suffixes to look for
+    :return: position in df of every offense count column, keyed by
+        (offense, demographic)
+    """
+    index = {}
+    names = offense_names(df, demographics)
+    for demo in demographics:
+        for name in names:
+            col = name + "_" + demo
+            if col in df.columns:
+                index[(name, demo)] = df.columns.get_loc(col)
+    return index
+
+
+@instrumented()
 def population(df, group1, group2, save=False):
     """
 
@@ -132,9 +404,9 @@ def population(df, group1, group2, save=False):
     :return:
     """
     population_data = (
-        df.groupby(group1, as_index=False)["population"]
+        df.groupby(group1, as_index=False, observed=True)["population"]
         .max()
-        .groupby(group2, as_index=False)[["population"]]
+        .groupby(group2, as_index=False, observed=True)[["population"]]
         .sum()
     )
     if save:
@@ -142,131 +414,76 @@ def population(df, group1, group2, save=False):
     return population_data
 
 
-def create_new_columns(df):
+@instrumented()
+def offense_totals(df, group1, group2, demographics=DEMOGRAPHICS):
     """
-
-    :param df:
-    :return:
+    County-month totals of every offense for every demographic, computed
+    in a single groupby, with the population merged in. Every crime
+    grouping is derived from this frame by create_new_columns.
+
+    :param df: arrest data
+    :param group1: grouping that identifies one agency report
+    :param group2: grouping of the output, e.g. month, year and county
+    :param demographics: demographic suffixes to aggregate
+    :return: one row per group2 key
     """
-    # Lists of non-violent crimes per demographic group:
-    non_violent_arrests = filter_columns("arrests", df)
-    non_violent_black = filter_columns("black", df)
-    non_violent_white = filter_columns("white", df)
-    non_violent_asian = filter_columns("asian", df)
-    non_violent_amer_ind = filter_columns("amer_ind", df)
-    non_violent_male = filter_columns("male", df)
-    non_violent_female = filter_columns("female", df)
-
-    # Add date column for easier filtering by date
-    df["year"] = df["year"].astype(str)
-    df["day"] = "01"
-    df["month"] = df.month.str.capitalize()
-    df["date"] = pd.to_datetime(
-        df.year + "-" + df.month + "-" + df.day, format="%Y-%B-%d"
-    )
-    df.drop("day", axis=1, inplace=True)
-
-    # Sum over all non violent crimes:
-    df["grand_total_arrests"] = np.sum(merged[non_violent_arrests], axis=1)
-    df["grand_total_black"] = np.sum(merged[non_violent_black], axis=1)
-    df["grand_total_white"] = np.sum(merged[non_violent_white], axis=1)
-    df["grand_total_asian"] = np.sum(merged[non_violent_asian], axis=1)
-    df["grand_total_amer_ind"] = np.sum(merged[non_violent_amer_ind], axis=1)
-    df["grand_total_male"] = np.sum(merged[non_violent_male], axis=1)
-    df["grand_total_female"] = np.sum(merged[non_violent_female], axis=1)
-
-    # Crime rate:
-    df["arrest_rate_gt_arrests"] = (
-        df["grand_total_arrests"] / df["population"] * 100_000
-    )
-    df["arrest_rate_gt_black"] = df["grand_total_black"] / df["population"] * 100_000
-    df["arrest_rate_gt_white"] = df["grand_total_white"] / df["population"] * 100_000
-    df["arrest_rate_gt_asian"] = df["grand_total_asian"] / df["population"] * 100_000
-    df["arrest_rate_gt_amer_ind"] = (
-        df["grand_total_amer_ind"] / df["population"] * 100_000
-    )
-    df["arrest_rate_gt_male"] = df["grand_total_male"] / df["population"] * 100_000
-    df["arrest_rate_gt_female"] = df["grand_total_female"] / df["population"] * 100_000
-
-    # Drop redundant columns:
-    df.drop(
-        non_violent_arrests
-        + non_violent_black
-        + non_violent_asian
-        + non_violent_male
-        + non_violent_female
-        + non_violent_white
-        + non_violent_amer_ind,
-        axis=1,
-        inplace=True,
-    )
-
-    # Add post treatment and treatment columns:
-    post_treatment = "2020-June-01"
-    treatment_group = "08031"
-    condition1 = df["date"] >= post_treatment
-    condition2 = df["fips_state_county_code"] == treatment_group
-    df["post_treatment"] = np.where(condition1, 1, 0)
-    df["treatment"] = np.where(condition2, 1, 0)
-    return df
+    cols = [
+        col
+        for demo in demographics
+        for col in filter_columns(demo, df, offense_names(df, demographics))
+    ]
+    totals = df.groupby(group2, as_index=False, observed=True)[cols].sum()
+    return pd.merge(totals, population(df, group1, group2), on=group2)
 
 
-def create_new_columns_vio(df):
+@instrumented()
+def create_new_columns(df, offenses, demographics=DEMOGRAPHICS):
     """
-    :param df:
-    :return:
+
+    :param df: offense totals from offense_totals
+    :param offenses: offense names of the crime grouping, e.g. VIOLENT_CRIMES
+    :param demographics: demographic suffixes to compute totals and rates for
+    :return: a new data frame with the grand totals and arrest rates of the
+        grouping, the date and the treatment columns
     """
-    # Lists of non-violent crimes per demographic group:
-    non_violent_arrests = filter_columns_violent("arrests", df)
-    non_violent_black = filter_columns_violent("black", df)
-    non_violent_white = filter_columns_violent("white", df)
-    non_violent_asian = filter_columns_violent("asian", df)
-    non_violent_amer_ind = filter_columns_violent("amer_ind", df)
-    non_violent_male = filter_columns_violent("male", df)
-    non_violent_female = filter_columns_violent("female", df)
+    index = column_index(df, demographics)
 
-    # Add date column for easier filtering by date
-    df["year"] = df["year"].astype(str)
-    df["day"] = "01"
-    df["month"] = df.month.str.capitalize()
-    df["date"] = pd.to_datetime(
-        df.year + "-" + df.month + "-" + df.day, format="%Y-%B-%d"
-    )
-    df.drop("day", axis=1, inplace=True)
-
-    # Sum over all non violent crimes:
-    df["grand_total_arrests"] = np.sum(df[non_violent_arrests], axis=1)
-    df["grand_total_black"] = np.sum(df[non_violent_black], axis=1)
-    df["grand_total_white"] = np.sum(df[non_violent_white], axis=1)
-    df["grand_total_asian"] = np.sum(df[non_violent_asian], axis=1)
-    df["grand_total_amer_ind"] = np.sum(df[non_violent_amer_ind], axis=1)
-    df["grand_total_male"] = np.sum(df[non_violent_male], axis=1)
-    df["grand_total_female"] = np.sum(df[non_violent_female], axis=1)
-
-    # Crime rate:
-    df["arrest_rate_gt_arrests"] = (
-        df["grand_total_arrests"] / df["population"] * 100_000
-    )
-    df["arrest_rate_gt_black"] = df["grand_total_black"] / df["population"] * 100_000
-    df["arrest_rate_gt_white"] = df["grand_total_white"] / df["population"] * 100_000
-    df["arrest_rate_gt_asian"] = df["grand_total_asian"] / df["population"] * 100_000
-    df["arrest_rate_gt_amer_ind"] = (
-        df["grand_total_amer_ind"] / df["population"] * 100_000
-    )
-    df["arrest_rate_gt_male"] = df["grand_total_male"] / df["population"] * 100_000
-    df["arrest_rate_gt_female"] = df["grand_total_female"] / df["population"] * 100_000
+    # Weights that pick the grouping's crimes out of every count column
+    # and add them up per demographic group
+    weights = np.zeros((len(index), len(demographics)), dtype=np.int64)
+    for row, (name, demo) in enumerate(index):
+        if name in offenses:
+            weights[row, demographics.index(demo)] = 1
+
+    # Sum over all crimes of the grouping and crime rate, for every
+    # demographic group at once:
+    counts = df.iloc[:, list(index.values())].fillna(0).to_numpy()
+    grand_totals = counts @ weights
+    rates = grand_totals / df["population"].to_numpy()[:, None] * 100_000
 
     # Drop redundant columns:
-    df.drop(
-        non_violent_arrests
-        + non_violent_black
-        + non_violent_asian
-        + non_violent_male
-        + non_violent_female
-        + non_violent_white
-        + non_violent_amer_ind,
+    redundant = set(index.values()) | set(column_index(df).values())
+    df = df.drop(df.columns[sorted(redundant)], axis=1)
+
+    # Add date column for easier filtering by date
+    df["date"] = month_starts(df["year"], df["month"])
+    df["month"] = month_categories(df["month"]).cat.rename_categories(str.capitalize)
+
+    df = pd.concat(
+        [
+            df,
+            pd.DataFrame(
+                grand_totals,
+                columns=["grand_total_" + demo for demo in demographics],
+                index=df.index,
+            ),
+            pd.DataFrame(
+                rates,
+                columns=["arrest_rate_gt_" + demo for demo in demographics],
+                index=df.index,
+            ),
+        ],
         axis=1,
-        inplace=True,
     )
 
     # Add post treatment and treatment columns:
@@ -276,64 +493,56 @@ def create_new_columns_vio(df):
     condition2 = df["fips_state_county_code"] == treatment_group
     df["post_treatment"] = np.where(condition1, 1, 0)
     df["treatment"] = np.where(condition2, 1, 0)
+
+    # Months since the start of the treatment, for event studies
+    start = pd.to_datetime(post_treatment, format="%Y-%B-%d")
+    df["relative_month"] = (df["date"].dt.year - start.year) * 12 + (
+        df["date"].dt.month - start.month
+    )
     return df
 
 
 if __name__ == "__main__":
-    DATA_PATH = "../00_source_data"
-    ARREST_DATA = os.path.join(
-        DATA_PATH, "ucr_arrests_monthly_all" "_crimes_race_sex_1974_2020_dta.zip"
-    )
-    arrests_2019, arrests_2020 = load_data()
-    arrests_2019, arrests_2020 = match_columns(arrests_2019, arrests_2020)
-    arrest_concat = filter_by_state_concat(arrests_2019, arrests_2020)
-
-    # Impute fips code based on agency name
-    arrest_concat.loc[
-        (arrest_concat["fips_state_county_code"] == "")
-        & (arrest_concat["agency_name"] == "us secret service, denve"),
-        "fips_state_county_code",
-    ] = "08031"
-
-    # Save ori and fips codes
-    (
-        arrest_concat[["ori", "fips_state_county_code"]]
-        .drop_duplicates()
-        .to_csv("../20_intermediate_files/ori.csv", index=False)
+    arrest_concat = load_arrests_parallel(
+        years=(2019, 2020), states=("CO",), cache_dir=ARREST_CACHE
     )
 
+    # Impute missing fips codes and normalize them to 5 characters
+    with stage("10_preprocessing.crosswalk", len(arrest_concat)):
+        arrest_concat["fips_state_county_code"] = normalize_fips(
+            impute_fips(arrest_concat)
+        )
+
+        # Save the ori / fips / agency crosswalk used by the crime data pipeline
+        crosswalk = build_crosswalk(arrest_concat, pd.read_csv(AGENCIES))
+        save_crosswalk(crosswalk, "../20_intermediate_files/crosswalk.parquet")
+
     # Filter by fips code
     fips_codes = ["08031", "08059", "08005", "08001", "08014", "08035", "08013"]
-    arrest_concat = arrest_concat.query(f"fips_state_county_code in {fips_codes}")
+    with stage("10_preprocessing.filter", len(arrest_concat)) as record:
+        arrest_concat = arrest_concat[
+            arrest_concat["fips_state_county_code"].isin(fips_codes)
+        ]
+        record["rows_out"] = len(arrest_concat)
 
-    # Filter columns
-    arrest_concat_nonvio = data_with_relevant_columns(arrest_concat)
-
-    # Aggregation
+    # Offense totals for every county and month, in one pass
     group1 = ["month", "year", "fips_state_county_code", "fips_place_code"]
     group2 = ["month", "year", "fips_state_county_code"]
-    population_norm = population(arrest_concat_nonvio, group1, group2)
-    cols_to_aggregate = arrest_concat_nonvio.columns.to_list()[14:]
-
-    arrests_agg = arrest_concat_nonvio.groupby(group2, as_index=False)[
-        cols_to_aggregate
-    ].sum()
-
-    merged = pd.merge(arrests_agg, population_norm, on=group2)
-
-    final_df = create_new_columns(merged)
-    final_df.to_csv("../20_intermediate_files/aggregated.csv", index=False)
-
-    ## Violent related
-    ## other things are the same only the columns are different
-    arrest_concat_vio = data_with_relevant_columns_violent(arrest_concat)
-    cols_to_aggregate_vio = arrest_concat_vio.columns.to_list()[14:]
-
-    arrests_agg_vio = arrest_concat_vio.groupby(group2, as_index=False)[
-        cols_to_aggregate_vio
-    ].sum()
-    merged_vio = pd.merge(arrests_agg_vio, population_norm, on=group2)
-    final_df_vio = create_new_columns_vio(merged_vio)
-    final_df_vio.to_csv(
-        "../20_intermediate_files/aggregated_violent_arrest.csv", index=False
-    )
+    totals = offense_totals(arrest_concat, group1, group2)
+
+    # Dense county x month x offense x demographic counts for the analysis
+    # code, which derives any crime grouping from it
+    with stage("10_preprocessing.cube", len(totals)):
+        save_cube(build_cube(totals, offense_names(totals), DEMOGRAPHICS), ARREST_CUBE)
+
+    # Every crime grouping is derived from the same totals
+    groupings = {
+        "aggregated.csv": non_violent_offenses(totals),
+        "aggregated_violent_arrest.csv": VIOLENT_CRIMES,
+    }
+    for file_name, offenses in groupings.items():
+        final_df = create_new_columns(totals, offenses)
+        with stage("10_preprocessing.write", len(final_df)):
+            final_df.to_csv(
+                os.path.join("../20_intermediate_files", file_name), index=False
+            )
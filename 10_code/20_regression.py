@@ -1,14 +1,42 @@
 import numpy as np
 import pandas as pd
-from linearmodels.panel import PanelOLS
+
+import arrest_cube
+import did
+import staggered
+import synthetic_control
 
 pd.set_option("display.max_columns", None)
 
-DATA_PATH = "20_intermediate_files/aggregated.csv"
-data = pd.read_csv(
-    DATA_PATH, dtype={"fips_state_county_code": str}, parse_dates=["date"]
-)
-arrests_count_columns = data.columns.to_list()[5:12]
+CUBE_PATH = "20_intermediate_files/arrest_cube"
+ADOPTIONS_PATH = "00_source_data/program_adoptions.csv"
+
+
+def read_panel(cube, offenses):
+    """
+
+    :param cube: arrest cube written by 10_preprocessing.py
+    :param offenses: offenses summed into the arrest counts and rates
+    :return: the data indexed by county FIPS code and month of the year
+    """
+    df = arrest_cube.panel_frame(cube, offenses)
+    df["month"] = df.date.dt.month
+    return df.set_index(["fips_state_county_code", "month"])
+
+
+def read_event_panel(cube, offenses):
+    """
+
+    :param cube: arrest cube written by 10_preprocessing.py
+    :param offenses: offenses summed into the arrest counts and rates
+    :return: the data indexed by county FIPS code and calendar month, so
+        that every lead and lag is compared with the other counties in the
+        same month
+    """
+    df = arrest_cube.panel_frame(cube, offenses)
+    return df.set_index(["fips_state_county_code", "date"])
+
+
 independent_vars = [
     "arrest_rate_gt_arrests",
     "arrest_rate_gt_black",
@@ -18,52 +46,127 @@ independent_vars = [
     "arrest_rate_gt_male",
     "arrest_rate_gt_female",
 ]
-data["month"] = data.date.dt.month
-data = (
-    data.reset_index()
-    .set_index(["fips_state_county_code", "month"])
-    .drop("index", axis=1)
-)
+# Every crime grouping is a sum over the offense axis of the memory mapped cube
+arrests = arrest_cube.load_cube(CUBE_PATH)
+data = read_panel(arrests, arrest_cube.non_violent_offenses(arrests))
+arrests_count_columns = data.columns.to_list()[3:10]
 
 placebo = data.query("post_treatment == 0").copy()
 fake_treatment = "2020-01-01"
 placebo["post_treatment"] = np.where(placebo["date"] > fake_treatment, 1, 0)
 
 
+DID_REGRESSORS = ["treatment", "post_treatment", "treatment:post_treatment"]
+
+# Robustness grid: every dataset is fitted with every specification and
+# covariance estimator
+SPECIFICATIONS = {"did": DID_REGRESSORS}
+COV_TYPES = ["clustered", "robust", "kernel"]
+
+# With 7 counties the clustered p-values are unreliable, so the interaction
+# is also tested with a wild cluster bootstrap that enumerates every draw
+BOOTSTRAP_WEIGHTS = ["rademacher", "webb"]
+
+# Randomization inference moves the treatment to every county and policy month
+TREATED_FIPS = "08031"
+POLICY_DATE = "2020-06-01"
+
+# Event study of the non-violent and violent groupings and of every offense
+# of the cube on its own, with clustered and bootstrap intervals. A rare
+# offense can have months without arrests in any control county, whose
+# leads and lags get no intervals; in the groupings that is an error.
+EVENT_STUDY_GROUPINGS = {
+    "non-violent": arrest_cube.non_violent_offenses(arrests),
+    "violent": arrest_cube.VIOLENT_CRIMES,
+}
+EVENT_STUDY_OFFENSES = {
+    **EVENT_STUDY_GROUPINGS,
+    **{offense[: -len("_tot")]: [offense] for offense in arrests["offenses"]},
+}
+EVENT_STUDY_DEGENERATE = {
+    crime_type: "raise" if crime_type in EVENT_STUDY_GROUPINGS else "missing"
+    for crime_type in EVENT_STUDY_OFFENSES
+}
+EVENT_STUDY_COV_TYPES = {
+    "clustered": {"cov_type": "clustered"},
+    "bootstrap": {"cov_type": "bootstrap", "weights": "webb", "draws": 9999},
+}
+
+
 def difference_in_difference(df):
-    result = []
-
-    for var in independent_vars:
-        model = PanelOLS.from_formula(
-            f"{var} ~ treatment + post_treatment"
-            "+ treatment * post_treatment + EntityEffects + TimeEffects",
-            df,
-            drop_absorbed=True,
-        ).fit(cov_type="clustered", cluster_entity=True)
-        summary = model.summary
-        summary_df = pd.DataFrame(summary.tables[1]).iloc[1:, :]
-        summary_df.rename(
-            {
-                0: "coefficient name",
-                1: "coef",
-                2: "std err",
-                3: "t",
-                4: "p-value",
-                5: "0.025",
-                6: "0.975",
-            },
-            axis=1,
-            inplace=True,
-        )
-        summary_df["independent variable"] = var
-        result.append(summary_df)
-
-    result_df = pd.concat(result, axis=0)
-    return result_df
-
-
-treatment = difference_in_difference(data)
-placebo_test = difference_in_difference(placebo)
-
-treatment.to_csv("20_intermediate_files/regression_results.csv", index=False)
-placebo_test.to_csv("20_intermediate_files/placebo_test.csv", index=False)
+    return did.fit(df, independent_vars, DID_REGRESSORS, cov_type="clustered")
+
+
+if __name__ == "__main__":
+    treatment = difference_in_difference(data)
+    placebo_test = difference_in_difference(placebo)
+
+    treatment.to_csv("20_intermediate_files/regression_results.csv", index=False)
+    placebo_test.to_csv("20_intermediate_files/placebo_test.csv", index=False)
+
+    grid = did.fit_grid(
+        {"treatment": data, "placebo": placebo},
+        independent_vars,
+        SPECIFICATIONS,
+        COV_TYPES,
+    )
+    grid.to_csv("20_intermediate_files/regression_grid.csv", index=False)
+
+    bootstrap = pd.concat(
+        [
+            did.wild_cluster_bootstrap(
+                df, independent_vars, DID_REGRESSORS, weights=weights
+            ).assign(dataset=name)
+            for name, df in [("treatment", data), ("placebo", placebo)]
+            for weights in BOOTSTRAP_WEIGHTS
+        ],
+        ignore_index=True,
+    )
+    bootstrap.to_csv("20_intermediate_files/wild_bootstrap.csv", index=False)
+
+    null = did.randomization_inference(data, independent_vars)
+    observed = null[
+        (null["entity"] == TREATED_FIPS) & (null["policy date"] == POLICY_DATE)
+    ]
+    p_values = did.randomization_p_values(
+        null, dict(zip(observed["independent variable"], observed["coef"]))
+    )
+    null.to_csv("20_intermediate_files/randomization_inference.csv", index=False)
+    p_values.to_csv("20_intermediate_files/randomization_p_values.csv", index=False)
+
+    event_study = pd.concat(
+        [
+            did.event_study(
+                read_event_panel(arrests, offenses),
+                independent_vars,
+                degenerate=EVENT_STUDY_DEGENERATE[crime_type],
+                **options,
+            ).assign(crime_type=crime_type, interval=interval)
+            for crime_type, offenses in EVENT_STUDY_OFFENSES.items()
+            for interval, options in EVENT_STUDY_COV_TYPES.items()
+        ],
+        ignore_index=True,
+    )
+    event_study.to_csv("20_intermediate_files/event_study.csv", index=False)
+
+    weights, gaps, synth_p_values = synthetic_control.synthetic_control_study(
+        data.reset_index(), independent_vars, TREATED_FIPS, POLICY_DATE
+    )
+    weights.to_csv("20_intermediate_files/synthetic_control_weights.csv", index=False)
+    gaps.to_csv("20_intermediate_files/synthetic_control_gaps.csv", index=False)
+    synth_p_values.to_csv(
+        "20_intermediate_files/synthetic_control_p_values.csv", index=False
+    )
+
+    # Staggered adoption: every county in the adoption table is treated from
+    # its own adoption month
+    cells = staggered.group_time_att(
+        data.reset_index(),
+        independent_vars,
+        staggered.read_adoptions(ADOPTIONS_PATH),
+        control="not_yet_treated",
+    )
+    overall, dynamic = staggered.aggregate_att(cells)
+    cells.to_csv("20_intermediate_files/staggered_att.csv", index=False)
+    overall.to_csv("20_intermediate_files/staggered_overall.csv", index=False)
+    dynamic.to_csv("20_intermediate_files/staggered_dynamic.csv", index=False)
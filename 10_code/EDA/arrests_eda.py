@@ -1,8 +1,35 @@
-from pandas.api.types import CategoricalDtype
 import seaborn as sns
 import pandas as pd
 import numpy as np
 import altair as alt
+import argparse
+import hashlib
+import json
+import matplotlib
+import matplotlib.pyplot as plt
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import arrest_cube
+import instrument
+from charts import CHART_PATH, group_means, sidecar_data, stacked_means
+from schema import month_categories
+
+CUBE_PATH = "../20_intermediate_files/arrest_cube"
+FIGURE_PATH = "../30_results/Plots/county trends"
+# Hash of every figure's spec and data slice and digests of its files, to
+# skip unchanged figures
+MANIFEST = ".figures.json"
+
+
+def calendar_months(month):
+    """
+
+    :param month: series of month names in any case
+    :return: ordered categorical of capitalized month names
+    """
+    return month_categories(month).cat.rename_categories(str.capitalize)
 
 
 def plot_monthly_total_rate_trend(df: pd.DataFrame, col_type: str):
@@ -11,26 +38,8 @@ def plot_monthly_total_rate_trend(df: pd.DataFrame, col_type: str):
     Input col_type : male, female, black, asian, amer_ind, white, arrests
     ouput: a graph that splits 2019 and 2020 by county
     """
-    # convert month from string to categorial in order to sort them
-    cat_type = CategoricalDtype(
-        categories=[
-            "January",
-            "February",
-            "March",
-            "April",
-            "May",
-            "June",
-            "July",
-            "August",
-            "September",
-            "October",
-            "November",
-            "December",
-        ],
-        ordered=True,
-    )
-
-    df["month"] = df["month"].astype(cat_type)
+    # ordered month categorical in order to sort them, df is left as is
+    df = df.assign(month=calendar_months(df["month"]))
     g = sns.FacetGrid(df, col="year", hue="fips_state_county_code")
     sub_str = "arrest_rate_gt_" + col_type
     g.map(sns.lineplot, "month", sub_str)
@@ -43,6 +52,7 @@ def plot_monthly_total_rate_trend(df: pd.DataFrame, col_type: str):
         labels=["Adams", "Boulder", "Broomfield", "Denver", "El Paso"],
         loc="upper right",
     )
+    return g
 
 
 def plot_monthly_certain_arrest_rate(df: pd.DataFrame, col_type: str, crime_type: str):
@@ -53,29 +63,13 @@ def plot_monthly_certain_arrest_rate(df: pd.DataFrame, col_type: str, crime_type
     Input col_type : male, female, black, asian, amer_ind, white, hispanic, non_hispanic
     ouput: a graph that splits 2019 and 2020 by county
     """
-    cat_type = CategoricalDtype(
-        categories=[
-            "january",
-            "february",
-            "march",
-            "april",
-            "may",
-            "june",
-            "july",
-            "august",
-            "september",
-            "october",
-            "november",
-            "december",
-        ],
-        ordered=True,
-    )
-
-    df["month"] = df["month"].astype(cat_type)
     # we only calculate the total arrest rate in the original function
     # now we're going to plot the rate so we need to calculate it here
     sub_str = crime_type + "_tot_" + col_type
-    df[sub_str + "_rate"] = df[sub_str] / df["population"] * 100_000
+    df = df.assign(
+        month=calendar_months(df["month"]),
+        **{sub_str + "_rate": df[sub_str] / df["population"] * 100_000},
+    )
     g = sns.FacetGrid(df, col="year", hue="fips_state_county_code")
     g.map(sns.lineplot, "month", sub_str + "_rate")
     g.set_xticklabels(rotation=45)
@@ -88,35 +82,41 @@ def plot_monthly_certain_arrest_rate(df: pd.DataFrame, col_type: str, crime_type
         labels=["Adams", "Boulder", "Broomfield", "Denver", "El Paso"],
         loc="upper right",
     )
+    return g
 
 
-def plot_grouped_arrest_trend(df, arrest_type: str):
+def plot_grouped_arrest_trend(df, arrest_type: str, data=None, series=None):
     """
     Plot mean arrest trend over time
     arrest_type: string specifying whether it's violent arrests or non-violent arrests
+    data: means of several arrest types from charts.stacked_means, usually
+        a charts.sidecar_data reference shared by many charts. The chart keeps
+        the rows whose arrest_type is series (arrest_type by default) and df
+        is not used. None inlines the means of df in the chart.
     """
     domain = ["Control", "Treatment"]
     range_ = ["blue", "red"]
 
-    grouped_means = df.groupby(["treatment", "date"], as_index=False)[
-        ["arrest_rate_gt_arrests"]
-    ].mean()
-    scatter = (
-        alt.Chart(grouped_means)
-        .mark_line()
-        .encode(
-            alt.X("date:T", scale=alt.Scale(zero=False), axis=alt.Axis(title="Date")),
-            alt.Y(
-                "arrest_rate_gt_arrests:Q",
-                scale=alt.Scale(zero=False),
-                axis=alt.Axis(title="Arrest Rate (per 100,000 people)"),
-            ),
-            alt.Color(
-                "treatment:N",
-                legend=alt.Legend(title="Legend"),
-                scale=alt.Scale(domain=domain, range=range_),
-            ),
+    if data is None:
+        chart = alt.Chart(
+            group_means(df, ["treatment", "date"], ["arrest_rate_gt_arrests"])
         )
+    else:
+        chart = alt.Chart(data).transform_filter(
+            alt.datum.arrest_type == (series or arrest_type)
+        )
+    scatter = chart.mark_line().encode(
+        alt.X("date:T", scale=alt.Scale(zero=False), axis=alt.Axis(title="Date")),
+        alt.Y(
+            "arrest_rate_gt_arrests:Q",
+            scale=alt.Scale(zero=False),
+            axis=alt.Axis(title="Arrest Rate (per 100,000 people)"),
+        ),
+        alt.Color(
+            "treatment:N",
+            legend=alt.Legend(title="Legend"),
+            scale=alt.Scale(domain=domain, range=range_),
+        ),
     )
     rule = (
         alt.Chart(pd.DataFrame({"date": ["2020-06-01"], "color": ["black"]}))
@@ -131,29 +131,191 @@ def plot_grouped_arrest_trend(df, arrest_type: str):
     )
 
 
-def main():
+def county_month_frame(cube):
+    """
+    Every column the county trend plots use, built once from the cube: the
+    non-violent grand totals and rates of panel_frame and the count of every
+    offense and demographic, e.g. theft_tot_black.
+
+    :param cube: cube from arrest_cube.load_cube
+    :return: one row per reported county and month
+    """
+    df = arrest_cube.panel_frame(cube, arrest_cube.non_violent_offenses(cube))
+    county, month = np.nonzero(cube["reported"])
+    counts = cube["counts"][county, month]
+    columns = {
+        offense + "_" + demo: counts[:, i, j]
+        for i, offense in enumerate(cube["offenses"])
+        for j, demo in enumerate(cube["demographics"])
+    }
+    return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+
+
+def trend_specs(cube):
+    """
+
+    :param cube: cube from arrest_cube.load_cube
+    :return: one spec per county trend figure: the total rate of every
+        demographic, and the rate of every offense and demographic
+    """
+    specs = [{"plot": "total", "col_type": demo} for demo in cube["demographics"]]
+    specs += [
+        {"plot": "certain", "crime_type": offense[: -len("_tot")], "col_type": demo}
+        for offense in cube["offenses"]
+        for demo in cube["demographics"]
+    ]
+    return specs
+
+
+def spec_columns(spec):
+    keys = ["year", "month", "fips_state_county_code"]
+    if spec["plot"] == "total":
+        return keys + ["arrest_rate_gt_" + spec["col_type"]]
+    return keys + ["population", spec["crime_type"] + "_tot_" + spec["col_type"]]
+
+
+def spec_name(spec):
+    if spec["plot"] == "total":
+        return "non violent crime " + spec["col_type"]
+    return spec["crime_type"] + " " + spec["col_type"]
+
+
+def spec_hash(df, spec):
+    """
+
+    :param df: frame from county_month_frame
+    :param spec: spec from trend_specs
+    :return: hex digest of the spec and of the rows and columns it plots
+    """
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode())
+    rows = pd.util.hash_pandas_object(df[spec_columns(spec)], index=False)
+    digest.update(rows.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """
+
+    :param path: file to hash
+    :return: hex digest of its contents, None when it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+_FARM_DATA = {}
+
+
+def _init_farm_worker(df):
+    matplotlib.use("Agg")
+    _FARM_DATA["df"] = df
+
+
+def _render_spec(df, spec, directory, formats):
+    data = df[spec_columns(spec)]
+    if spec["plot"] == "total":
+        g = plot_monthly_total_rate_trend(data, spec["col_type"])
+    else:
+        g = plot_monthly_certain_arrest_rate(data, spec["col_type"], spec["crime_type"])
+    for file_format in formats:
+        g.fig.savefig(os.path.join(directory, spec_name(spec) + "." + file_format))
+    plt.close(g.fig)
+
+
+def _render_farm_spec(args):
+    _render_spec(_FARM_DATA["df"], *args)
+
+
+@instrument.instrumented()
+def render_figures(
+    df, specs, directory=FIGURE_PATH, formats=("png",), max_workers=None, force=False
+):
+    """
+    Render the figures of the specs on a process pool. A figure is skipped
+    when the hash of its spec and data slice matches the one recorded in the
+    directory's manifest and its files are still the ones written then.
+
+    :param df: frame from county_month_frame, sent to every worker once
+    :param specs: specs from trend_specs
+    :param directory: output directory, created if needed
+    :param formats: file formats, e.g. ("png", "svg")
+    :param max_workers: number of processes, 1 renders in this process
+    :param force: render every figure
+    :return: names of the rendered figures
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    def files(spec):
+        return {
+            fmt: os.path.join(directory, spec_name(spec) + "." + fmt) for fmt in formats
+        }
+
+    def is_current(spec):
+        # Entries of older manifests hold only the spec hash
+        entry = manifest.get(spec_name(spec))
+        if not isinstance(entry, dict) or entry["spec"] != hashes[spec_name(spec)]:
+            return False
+        return all(
+            entry["files"].get(fmt) == file_digest(path)
+            for fmt, path in files(spec).items()
+        )
+
+    hashes = {spec_name(spec): spec_hash(df, spec) for spec in specs}
+    stale = [spec for spec in specs if force or not is_current(spec)]
+    tasks = [(spec, directory, list(formats)) for spec in stale]
+    if max_workers == 1:
+        # Headless like the workers, the figures are only written to files
+        matplotlib.use("Agg")
+        for task in tasks:
+            _render_spec(df, *task)
+    elif tasks:
+        with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_farm_worker, initargs=(df,)
+        ) as executor:
+            list(executor.map(_render_farm_spec, tasks))
+
+    for spec in stale:
+        manifest[spec_name(spec)] = {
+            "spec": hashes[spec_name(spec)],
+            "files": {fmt: file_digest(path) for fmt, path in files(spec).items()},
+        }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return [spec_name(spec) for spec in stale]
+
+
+def main(formats=("png",), max_workers=None, force=False, inline_charts=False):
+    arrests = arrest_cube.load_cube(CUBE_PATH)
+
+    ## county trends of every demographic and offense
+    rendered = render_figures(
+        county_month_frame(arrests),
+        trend_specs(arrests),
+        formats=formats,
+        max_workers=max_workers,
+        force=force,
+    )
+    print(f"Rendered {len(rendered)} county trend figures")
+
     ## non violent arrests
-    df_total_arrest = pd.read_csv("../20_intermediate_files/aggregated.csv")
+    df_total_arrest = arrest_cube.panel_frame(
+        arrests, arrest_cube.non_violent_offenses(arrests)
+    )
     df_total_arrest["treatment"] = np.where(
         df_total_arrest["treatment"] == 1, "Treatment", "Control"
     )
     df_total_arrest_pre = df_total_arrest[df_total_arrest["post_treatment"] == 0]
     # df_total_arrest_post = df_total_arrest[df_total_arrest.loc["post_treatment"]==1]
 
-    plot_monthly_total_rate_trend(df_total_arrest, "arrests")
-    plot_monthly_total_rate_trend(df_total_arrest, "male")
-    plot_monthly_total_rate_trend(df_total_arrest, "female")
-    plot_monthly_total_rate_trend(df_total_arrest, "black")
-    plot_monthly_total_rate_trend(df_total_arrest, "white")
-    plot_monthly_total_rate_trend(df_total_arrest, "asian")
-    plot_monthly_total_rate_trend(df_total_arrest, "amer_ind")
-    plot_grouped_arrest_trend(df_total_arrest, "Non-violent")
-    plot_grouped_arrest_trend(df_total_arrest_pre, "Non-violent")
-
     ## violent arrests
-    df_total_arrest_vio = pd.read_csv(
-        "../20_intermediate_files/aggregated_violent_arrest.csv"
-    )
+    df_total_arrest_vio = arrest_cube.panel_frame(arrests, arrest_cube.VIOLENT_CRIMES)
     df_total_arrest_vio["treatment"] = np.where(
         df_total_arrest_vio["treatment"] == 1, "Treatment", "Control"
     )
@@ -162,10 +324,45 @@ def main():
     ]
     # df_total_arrest__vio_post = df_total_arrest_vio[df_total_arrest_vio["post_treatment"]==1]
 
-    plot_grouped_arrest_trend(df_total_arrest, "Both")
-    plot_grouped_arrest_trend(df_total_arrest_vio, "Violent")
-    plot_grouped_arrest_trend(df_total_arrest_vio_pre, "Violent")
+    ## average arrest trends, aggregated once into one file that every
+    ## chart of the page reads
+    frames = {
+        "Non-violent": df_total_arrest,
+        "Non-violent pre-policy": df_total_arrest_pre,
+        "Violent": df_total_arrest_vio,
+        "Violent pre-policy": df_total_arrest_vio_pre,
+    }
+    data = None
+    if not inline_charts:
+        means = stacked_means(
+            frames, ["treatment", "date"], ["arrest_rate_gt_arrests"], "arrest_type"
+        )
+        data = sidecar_data(
+            means, os.path.join(CHART_PATH, "data"), "arrest_trends", url="data"
+        )
+    charts = [
+        plot_grouped_arrest_trend(frames[series], arrest_type, data, series)
+        for arrest_type, series in [
+            ("Non-violent", "Non-violent"),
+            ("Non-violent", "Non-violent pre-policy"),
+            ("Both", "Non-violent"),
+            ("Violent", "Violent"),
+            ("Violent", "Violent pre-policy"),
+        ]
+    ]
+    os.makedirs(CHART_PATH, exist_ok=True)
+    alt.vconcat(*charts).save(os.path.join(CHART_PATH, "arrest_trends.html"))
 
 
-if __name__ == main:
-    main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the arrest EDA figures.")
+    parser.add_argument("--formats", nargs="+", default=["png"])
+    parser.add_argument("--workers", type=int, help="rendering processes")
+    parser.add_argument("--force", action="store_true", help="render every figure")
+    parser.add_argument(
+        "--inline-charts", action="store_true", help="inline the chart data"
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure_from_args(args)
+    main(args.formats, args.workers, args.force, args.inline_charts)
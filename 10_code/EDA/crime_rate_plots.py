@@ -1,5 +1,6 @@
 # %%
 # importing required libraries
+import os
 import numpy as np
 import pandas as pd
 from pandas.api.types import CategoricalDtype
@@ -8,6 +9,9 @@ import seaborn as sns
 from datetime import datetime
 import altair as alt
 
+from charts import CHART_PATH, group_means, sidecar_data, stacked_means
+from dates import month_starts
+
 df_full = pd.read_csv("../20_intermediate_files/crime_rate.csv")
 
 # %%
@@ -31,13 +35,9 @@ df = pd.concat([df_2020, df_2019])
 
 # %%
 # Creating date and treatment columns for plots
-df["date"] = pd.to_datetime(
-    df.DATA_YEAR.astype(str) + "-" + df.month + "-01", format="%Y-%b-%d"
-)
+df["date"] = month_starts(df.DATA_YEAR, df.month)
 df["treatment"] = np.where(df["fips"] == 8031, 1, 0)
-df_full["date"] = pd.to_datetime(
-    df_full.DATA_YEAR.astype(str) + "-" + df_full.month + "-01", format="%Y-%b-%d"
-)
+df_full["date"] = month_starts(df_full.DATA_YEAR, df_full.month)
 df_full["treatment"] = np.where(df_full["fips"] == 8031, "Treatment", "Control")
 
 # %%
@@ -50,28 +50,30 @@ df_full_nonviolent = df_full.loc[df_full["violent_crime"] == 0, :]
 
 # %%
 # Function to create plots
-def plot_crime_rate_trend(df, crime_type):
+# data: shared means of several crime types from charts.stacked_means, the
+# chart keeps the rows of series (crime_type by default) and df is not used;
+# None inlines the means of df in the chart
+def plot_crime_rate_trend(df, crime_type, data=None, series=None):
     domain = ["Control", "Treatment"]
     range_ = ["blue", "red"]
-    grouped_means = df.groupby(["treatment", "date"], as_index=False)[
-        ["crime_rate"]
-    ].mean()
-    scatter = (
-        alt.Chart(grouped_means)
-        .mark_line()
-        .encode(
-            alt.X("date:T", scale=alt.Scale(zero=False), axis=alt.Axis(title="Date")),
-            alt.Y(
-                "crime_rate:Q",
-                scale=alt.Scale(zero=False),
-                axis=alt.Axis(title="Crime Rate (per 100,000 people)"),
-            ),
-            alt.Color(
-                "treatment:N",
-                legend=alt.Legend(title="Legend"),
-                scale=alt.Scale(domain=domain, range=range_),
-            ),
+    if data is None:
+        chart = alt.Chart(group_means(df, ["treatment", "date"], ["crime_rate"]))
+    else:
+        chart = alt.Chart(data).transform_filter(
+            alt.datum.crime_type == (series or crime_type)
         )
+    scatter = chart.mark_line().encode(
+        alt.X("date:T", scale=alt.Scale(zero=False), axis=alt.Axis(title="Date")),
+        alt.Y(
+            "crime_rate:Q",
+            scale=alt.Scale(zero=False),
+            axis=alt.Axis(title="Crime Rate (per 100,000 people)"),
+        ),
+        alt.Color(
+            "treatment:N",
+            legend=alt.Legend(title="Legend"),
+            scale=alt.Scale(domain=domain, range=range_),
+        ),
     )
     rule = (
         alt.Chart(pd.DataFrame({"date": ["2020-06-01"], "color": ["black"]}))
@@ -84,10 +86,28 @@ def plot_crime_rate_trend(df, crime_type):
     )
 
 
+# %%
+# Aggregating every period and crime type once into one file that all the
+# charts of the page read
+frames = {
+    "Non-Violent pre-policy": df_nonviolent,
+    "Violent pre-policy": df_violent,
+    "Non-Violent": df_full_nonviolent,
+    "Violent": df_full_violent,
+}
+means = stacked_means(frames, ["treatment", "date"], ["crime_rate"], "crime_type")
+data = sidecar_data(means, os.path.join(CHART_PATH, "data"), "crime_trends", url="data")
+
 # For Pre Treatment Period
-plot_crime_rate_trend(df_nonviolent, "Non-Violent")
-plot_crime_rate_trend(df_violent, "Violent")
+charts = [
+    plot_crime_rate_trend(df_nonviolent, "Non-Violent", data, "Non-Violent pre-policy"),
+    plot_crime_rate_trend(df_violent, "Violent", data, "Violent pre-policy"),
+]
 
 # For complete review period
-plot_crime_rate_trend(df_full_nonviolent, "Non-Violent")
-plot_crime_rate_trend(df_full_violent, "Violent")
+charts += [
+    plot_crime_rate_trend(df_full_nonviolent, "Non-Violent", data),
+    plot_crime_rate_trend(df_full_violent, "Violent", data),
+]
+os.makedirs(CHART_PATH, exist_ok=True)
+alt.vconcat(*charts).save(os.path.join(CHART_PATH, "crime_trends.html"))
@@ -0,0 +1,158 @@
+import os
+import numpy as np
+import pandas as pd
+
+from dates import month_ordinals
+from instrument import instrumented
+
+
+VIOLENT_CRIMES = [
+    "agg_assault_tot",
+    "arson_tot",
+    "burglary_tot",
+    "manslaught_neg_tot",
+    "murder_tot",
+    "oth_assault_tot",
+    "oth_sex_off_tot",
+    "rape_tot",
+    "robbery_tot",
+]
+
+# Every array of a cube is stored as <name>.npy, so each of them can be
+# memory mapped on its own
+CUBE_ARRAYS = [
+    "counties",
+    "months",
+    "offenses",
+    "demographics",
+    "counts",
+    "population",
+    "reported",
+]
+
+
+def build_cube(totals, offenses, demographics):
+    """
+    Dense county x month x offense x demographic array of the arrest counts,
+    with its axis labels, the population of every county and month and a
+    mask of the county months that have data.
+
+    :param totals: offense totals with month, year and fips_state_county_code
+    :param offenses: offense names, e.g. "theft_tot"
+    :param demographics: demographic suffixes, e.g. "black"
+    :return: {name: array} with the arrays of CUBE_ARRAYS
+    """
+    counties, county = np.unique(
+        totals["fips_state_county_code"].to_numpy(dtype=str), return_inverse=True
+    )
+    stamp = month_ordinals(totals["year"], totals["month"])
+    first = stamp.min()
+    months = np.arange(first, stamp.max() + 1).astype("datetime64[M]")
+    month = stamp - first
+
+    columns = [offense + "_" + demo for offense in offenses for demo in demographics]
+    block = totals.reindex(columns=columns).fillna(0).to_numpy(dtype=np.int64)
+    counts = np.zeros(
+        (len(counties), len(months), len(offenses), len(demographics)), dtype=np.int64
+    )
+    counts[county, month] = block.reshape(-1, len(offenses), len(demographics))
+
+    population = np.zeros((len(counties), len(months)), dtype=np.int64)
+    population[county, month] = totals["population"].to_numpy()
+    reported = np.zeros((len(counties), len(months)), dtype=bool)
+    reported[county, month] = True
+
+    return {
+        "counties": counties,
+        "months": months,
+        "offenses": np.array(offenses, dtype=str),
+        "demographics": np.array(demographics, dtype=str),
+        "counts": counts,
+        "population": population,
+        "reported": reported,
+    }
+
+
+def save_cube(cube, directory):
+    """
+
+    :param cube: cube from build_cube
+    :param directory: directory of the .npy files, created if needed
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in CUBE_ARRAYS:
+        np.save(os.path.join(directory, name + ".npy"), cube[name])
+
+
+def load_cube(directory, mmap_mode="r"):
+    """
+
+    :param directory: directory written by save_cube
+    :param mmap_mode: mode of np.load, None reads the arrays into memory
+    :return: {name: array}, memory mapped by default
+    """
+    return {
+        name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+        for name in CUBE_ARRAYS
+    }
+
+
+def non_violent_offenses(cube):
+    """
+
+    :param cube: cube from build_cube or load_cube
+    :return: every offense of the cube that is not in VIOLENT_CRIMES
+    """
+    return [name for name in cube["offenses"] if name not in VIOLENT_CRIMES]
+
+
+def grouping_totals(cube, offenses):
+    """
+    Arrests of a crime grouping: a sum over the offense axis, reading the
+    cube once.
+
+    :param cube: cube from build_cube or load_cube
+    :param offenses: offense names of the grouping, e.g. VIOLENT_CRIMES
+    :return: county x month x demographic totals
+    """
+    weights = np.isin(cube["offenses"], list(offenses)).astype(np.int64)
+    return np.tensordot(cube["counts"], weights, axes=([2], [0]))
+
+
+@instrumented()
+def panel_frame(cube, offenses, treated="08031", policy_month="2020-06"):
+    """
+    The columns of aggregated.csv for any crime grouping, built from the
+    cube instead of a CSV.
+
+    :param cube: cube from build_cube or load_cube
+    :param offenses: offense names of the grouping
+    :param treated: FIPS code of the treated county
+    :param policy_month: first month of the treatment
+    :return: one row per reported county and month
+    """
+    county, month = np.nonzero(cube["reported"])
+    months = cube["months"][month]
+    population = cube["population"][county, month]
+    totals = grouping_totals(cube, offenses)[county, month]
+    rates = totals / population[:, None] * 100_000
+    start = np.datetime64(policy_month, "M")
+    dates = pd.DatetimeIndex(months.astype("datetime64[ns]"))
+
+    df = pd.DataFrame(
+        {
+            "month": dates.month_name(),
+            "year": dates.year,
+            "fips_state_county_code": cube["counties"][county].astype(object),
+            "population": population,
+            "date": dates,
+        }
+    )
+    for i, demo in enumerate(cube["demographics"]):
+        df["grand_total_" + demo] = totals[:, i]
+    for i, demo in enumerate(cube["demographics"]):
+        df["arrest_rate_gt_" + demo] = rates[:, i]
+    df["post_treatment"] = (months >= start).astype(int)
+    df["treatment"] = (df["fips_state_county_code"] == treated).astype(int)
+    df["relative_month"] = (months - start).astype(int)
+    return df
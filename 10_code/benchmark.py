@@ -0,0 +1,371 @@
+import argparse
+import datetime
+import gc
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+import did
+from crosswalk import build_crosswalk, impute_fips, normalize_fips
+from nibrs import (
+    INCIDENT_COLS,
+    OFFENSE_COLS,
+    VIOLENT_CATEGORIES,
+    classify_incidents,
+    offense_categories,
+    read_filtered_csv,
+)
+from synthetic_data import (
+    AGENCIES_FILE,
+    ARREST_ZIP,
+    CRIME_DIR,
+    INCIDENT_FILE,
+    OFFENSE_FILE,
+    OFFENSE_TYPE_FILE,
+    SCALES,
+    STUDY_COUNTIES,
+    write_dataset,
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "20_intermediate_files", "synthetic")
+REPORT_DIR = os.path.join(ROOT, "30_results", "benchmarks")
+
+GROUP1 = ["month", "year", "fips_state_county_code", "fips_place_code"]
+GROUP2 = ["month", "year", "fips_state_county_code"]
+DID_REGRESSORS = ["treatment", "post_treatment", "treatment:post_treatment"]
+
+# A stage whose wall time grew by more than this factor is a regression
+THRESHOLD = 1.25
+
+
+def preprocessing():
+    """
+
+    :return: 10_preprocessing.py as a module, its file name is not importable
+    """
+    if "preprocessing" in sys.modules:
+        return sys.modules["preprocessing"]
+    path = os.path.join(ROOT, "10_code", "10_preprocessing.py")
+    spec = importlib.util.spec_from_file_location("preprocessing", path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that its functions can be pickled for the process pool
+    # of load_arrests_parallel
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def dataset(scale, data_dir=DATA_DIR, regenerate=False):
+    """
+    Synthetic source data of a scale, generated on first use and reused by
+    later runs. A marker file is written last, so an interrupted generation
+    is redone.
+
+    :param scale: name of a scale in synthetic_data.SCALES
+    :param data_dir: directory of the generated datasets
+    :param regenerate: write the data even if it exists
+    :return: directory of the data, with the layout of 00_source_data
+    """
+    directory = os.path.join(data_dir, scale)
+    marker = os.path.join(directory, ".complete")
+    if regenerate or not os.path.exists(marker):
+        write_dataset(directory, **SCALES[scale])
+        with open(marker, "w") as f:
+            json.dump(SCALES[scale], f)
+    return directory
+
+
+def n_rows(result):
+    """
+
+    :param result: return value of a stage
+    :return: length of a data frame or array, or of the first element of a
+        tuple, None when it has no length
+    """
+    if isinstance(result, tuple):
+        result = result[0]
+    return len(result) if hasattr(result, "__len__") else None
+
+
+def measure(func, trace_memory=True):
+    """
+    Run func once and record its wall time, CPU time and memory. The peak
+    of the allocations comes from tracemalloc, which numpy and pandas
+    report their buffers to; max RSS is the high water mark of the whole
+    process so far.
+
+    :param func: function without arguments
+    :param trace_memory: trace allocations, which slows down pure Python
+        code
+    :return: (result of func, {measure: value})
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func()
+    record = {
+        "wall_seconds": time.perf_counter() - wall,
+        "cpu_seconds": time.process_time() - cpu,
+        "peak_traced_mb": None,
+    }
+    if trace_memory:
+        record["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    record["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result, record
+
+
+def run_scale(scale, data_dir=DATA_DIR, trace_memory=True, regenerate=False):
+    """
+    Run every stage of the pipeline on the synthetic data of one scale, the
+    way 10_preprocessing.py runs them: the Colorado arrests loaded on the
+    process pool through the Parquet cache, once with the cache cold and
+    once warm, the FIPS imputation and the filter to the study counties,
+    then the aggregate and rate computation and the DiD fit of the study
+    counties; and the load and crime classification of the NIBRS data.
+
+    The load stages run in worker processes, their CPU time and traced
+    allocations are not counted, only their wall time and the max RSS of
+    this process.
+
+    :param scale: name of a scale in synthetic_data.SCALES
+    :param data_dir: directory of the generated datasets
+    :param trace_memory: record peak allocations with tracemalloc
+    :param regenerate: write the data even if it exists
+    :return: one record per stage, in pipeline order
+    """
+    directory = dataset(scale, data_dir, regenerate)
+    crime_dir = os.path.join(directory, CRIME_DIR)
+    cache_dir = os.path.join(directory, "arrest_cache")
+    options = SCALES[scale]
+    pre = preprocessing()
+    records = []
+
+    def stage(name, func, rows_in=None):
+        result, record = measure(func, trace_memory)
+        records.append(
+            {
+                "scale": scale,
+                "stage": name,
+                "rows_in": rows_in,
+                "rows_out": n_rows(result),
+                **record,
+            }
+        )
+        return result
+
+    def load():
+        return pre.load_arrests_parallel(
+            os.path.join(directory, ARREST_ZIP),
+            options["years"],
+            states=("CO",),
+            cache_dir=cache_dir,
+        )
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    stage("load cold cache", load)
+    arrests = stage("load warm cache", load)
+
+    def impute():
+        arrests["fips_state_county_code"] = normalize_fips(impute_fips(arrests))
+        return arrests
+
+    stage("fips", impute, len(arrests))
+    study = stage(
+        "filter",
+        lambda: arrests[arrests["fips_state_county_code"].isin(STUDY_COUNTIES)],
+        len(arrests),
+    )
+    totals = stage(
+        "aggregate", lambda: pre.offense_totals(study, GROUP1, GROUP2), len(study)
+    )
+    panel = stage(
+        "rates",
+        lambda: pre.create_new_columns(totals, pre.non_violent_offenses(totals)),
+        len(totals),
+    )
+    ori = arrests[["ori", "fips_state_county_code"]].drop_duplicates()
+    del arrests
+
+    def crime_load():
+        crosswalk = build_crosswalk(
+            ori, pd.read_csv(os.path.join(crime_dir, AGENCIES_FILE))
+        )
+        incidents = read_filtered_csv(
+            [
+                os.path.join(crime_dir, INCIDENT_FILE.format(year=year))
+                for year in options["nibrs_years"]
+            ],
+            INCIDENT_COLS,
+            "AGENCY_ID",
+            crosswalk.index,
+        )
+        offenses = read_filtered_csv(
+            [
+                os.path.join(crime_dir, OFFENSE_FILE.format(year=year))
+                for year in options["nibrs_years"]
+            ],
+            OFFENSE_COLS,
+            "INCIDENT_ID",
+            incidents["INCIDENT_ID"],
+        )
+        return incidents, offenses
+
+    incidents, offenses = stage("crime load", crime_load)
+
+    def classify():
+        offense_type = pd.read_csv(os.path.join(crime_dir, OFFENSE_TYPE_FILE))
+        offense_incident = pd.Index(incidents["INCIDENT_ID"]).get_indexer(
+            offenses["INCIDENT_ID"]
+        )
+        offense_category, category_names = offense_categories(
+            offense_type, offenses["OFFENSE_TYPE_ID"]
+        )
+        return classify_incidents(
+            offense_incident,
+            offense_category,
+            len(incidents),
+            np.isin(category_names, VIOLENT_CATEGORIES),
+        )
+
+    stage("crime classification", classify, len(offenses))
+
+    outcomes = [col for col in panel.columns if col.startswith("arrest_rate_gt_")]
+    data = panel.set_index(["fips_state_county_code", "date"])
+    stage(
+        "did fit",
+        lambda: did.fit(data, outcomes, DID_REGRESSORS, cov_type="clustered"),
+        len(data),
+    )
+    return records
+
+
+def environment():
+    """
+
+    :return: the machine, library versions and commit a report was made on
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run(scales, data_dir=DATA_DIR, trace_memory=True, regenerate=False):
+    """
+    Benchmark every scale in a fresh process, so the max RSS of a scale is
+    not inflated by the ones before it.
+
+    :param scales: names of scales in synthetic_data.SCALES
+    :param data_dir: directory of the generated datasets
+    :param trace_memory: record peak allocations with tracemalloc
+    :param regenerate: write the data even if it exists
+    :return: the report, see environment and run_scale
+    """
+    results = []
+    for scale in scales:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results += executor.submit(
+                run_scale, scale, data_dir, trace_memory, regenerate
+            ).result()
+    return {
+        "environment": environment(),
+        "scales": {scale: SCALES[scale] for scale in scales},
+        "trace_memory": trace_memory,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold=THRESHOLD):
+    """
+    Ratios of the wall time and peak memory of every stage to a baseline
+    report, for the scales and stages found in both.
+
+    :param report: report from run
+    :param baseline: earlier report from run
+    :param threshold: wall time ratio above which a stage is a regression
+    :return: one row per scale and stage
+    """
+    keys = ["scale", "stage"]
+    measures = ["wall_seconds", "peak_traced_mb"]
+    new = pd.DataFrame(report["results"])[keys + measures]
+    old = pd.DataFrame(baseline["results"])[keys + measures]
+    df = pd.merge(old, new, on=keys, suffixes=("_baseline", ""))
+    for col in measures:
+        df[col + "_ratio"] = df[col] / df[col + "_baseline"]
+    df["regression"] = df["wall_seconds_ratio"] > threshold
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time and memory profile the pipeline stages on synthetic data"
+    )
+    parser.add_argument(
+        "--scales", nargs="+", choices=list(SCALES), default=["study", "regional"]
+    )
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output", help="report file, defaults to REPORT_DIR")
+    parser.add_argument(
+        "--compare", metavar="BASELINE", help="report to compare the run with"
+    )
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="skip tracemalloc, for timings without its overhead",
+    )
+    parser.add_argument("--regenerate", action="store_true")
+    args = parser.parse_args()
+
+    report = run(args.scales, args.data_dir, not args.no_trace_memory, args.regenerate)
+    output = args.output
+    if output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(REPORT_DIR, f"benchmark_{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    columns = ["scale", "stage", "rows_in", "rows_out"]
+    columns += ["wall_seconds", "cpu_seconds", "peak_traced_mb", "max_rss_mb"]
+    print(pd.DataFrame(report["results"])[columns].to_string(index=False))
+    print(f"Report written to {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            comparison = compare(report, json.load(f), args.threshold)
+        print(comparison.to_string(index=False))
+        if comparison["regression"].any():
+            sys.exit(1)
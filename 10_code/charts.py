@@ -0,0 +1,71 @@
+import os
+import altair as alt
+import pandas as pd
+
+
+CHART_PATH = "../30_results/Plots/charts"
+SIDECAR_FORMATS = ["json", "csv"]
+
+
+def group_means(df, keys, values):
+    """
+    Aggregate before charting, so a chart carries one row per plotted point
+    instead of one per county.
+
+    :param df: data frame
+    :param keys: grouping columns, e.g. ["treatment", "date"]
+    :param values: columns to average
+    :return: one row per observed combination of keys
+    """
+    return df.groupby(keys, as_index=False, observed=True)[values].mean()
+
+
+def stacked_means(frames, keys, values, series="series"):
+    """
+    The means of several frames in one table, so many charts can read one
+    shared dataset and filter it on the series column.
+
+    :param frames: {series label: data frame}
+    :param keys: grouping columns, see group_means
+    :param values: columns to average
+    :param series: name of the column holding the labels
+    :return: the stacked means
+    """
+    return pd.concat(
+        [
+            group_means(df, keys, values).assign(**{series: label})
+            for label, df in frames.items()
+        ],
+        ignore_index=True,
+    )
+
+
+def sidecar_data(df, directory, name, file_format="json", url=None):
+    """
+    Write the data of one or more charts to a file and return a reference
+    to it, so the chart specs hold a URL instead of the rows. Vega-Lite
+    reads JSON and CSV but not Arrow, so those are the formats offered.
+
+    :param df: chart data, usually from group_means or stacked_means
+    :param directory: directory of the file, created if needed
+    :param name: file name without extension
+    :param file_format: "json" or "csv"
+    :param url: URL of directory as seen from the chart, defaults to
+        directory
+    :return: alt.UrlData pointing at the file
+    """
+    if file_format not in SIDECAR_FORMATS:
+        raise ValueError(f"file_format must be one of {SIDECAR_FORMATS}")
+    os.makedirs(directory, exist_ok=True)
+    file_name = name + "." + file_format
+    path = os.path.join(directory, file_name)
+    if file_format == "json":
+        df.to_json(path, orient="records", date_format="iso")
+    else:
+        df.to_csv(path, index=False)
+
+    base = directory if url is None else url
+    return alt.UrlData(
+        url=base.rstrip("/") + "/" + file_name,
+        format=alt.DataFormat(type=file_format),
+    )
@@ -2,138 +2,133 @@
 # ## Crime Data Cleaning
 
 # %%
+import os
 import pandas as pd
 import numpy as np
 
-# %%
-# load source data
-agencies = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/00_source_data/agencies.csv")
-offense_type = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/00_source_data/NIBRS_offense_type.csv")
-incident_19 = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/00_source_data/2019_NIBRS_incident.csv")
-incident_20 = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/00_source_data/2020_NIBRS_incident.csv")
-offense_19 = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/00_source_data/2019_NIBRS_offense.csv")
-offense_20 = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/00_source_data/2020_NIBRS_offense.csv")
-
-# %%
-# load intermediate data with fips codes, ori numbers and population
-fips = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/20_intermediate_files/ori.csv")
-pop = pd.read_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/20_intermediate_files/population.csv")
-
-# %%
-# combine 2019 and 2020 data
-all_incidents = pd.concat([incident_19, incident_20])
-all_offenses = pd.concat([offense_19, offense_20])
-
-# %%
-# subset to just the columns we want
-agencies = agencies[["COUNTY_NAME","AGENCY_ID","ORI"]]
-
-# %%
-# change ori to be a string
-fips["ORI"] = fips["ori"].astype(str)
-
-# %%
-# add trailing zeros to the ORI number
-fips['ORI'] = fips['ORI'].apply(lambda x: x.ljust(2 + len(x), '0'))
+from crosswalk import agency_codes, load_crosswalk, normalize_fips
+from dates import month_labels, parse_incident_dates
+from instrument import stage
+from nibrs import INCIDENT_COLS, OFFENSE_COLS, VIOLENT_CATEGORIES, classify_incidents, offense_categories, read_filtered_csv
+from schema import align_categories, crime_schema
 
 # %%
-# make sure it worked
-fips.ORI.head()
+# paths are relative to 10_code, which is where the pipeline runs this script
+DATA_PATH = "../00_source_data/Crime data"
+INTERMEDIATE_PATH = "../20_intermediate_files"
 
 # %%
-# merge agencies and fips on ORI number
-merged_ori = pd.merge(fips, agencies, on="ORI", how="inner")
-
-# %%
-# remove nan values
-merged_ori = merged_ori.loc[merged_ori["fips_state_county_code"].isna() == False].copy()
+# load source data
+offense_type = pd.read_csv(os.path.join(DATA_PATH, "NIBRS_OFFENSE_TYPE.csv"))
 
 # %%
-# change fips code to string value
-merged_ori["fips"] = merged_ori.fips_state_county_code.astype(str).str[:4]
-pop['fips'] = pop.fips_state_county_code.astype(str)
+# load intermediate data: the ori / fips / agency crosswalk written by
+# 10_preprocessing, indexed by AGENCY_ID, with categorical labels, and the
+# population
+crosswalk = crime_schema(load_crosswalk(os.path.join(INTERMEDIATE_PATH, "crosswalk.parquet")))
+pop = pd.read_csv(os.path.join(INTERMEDIATE_PATH, "population.csv"))
 
 # %%
-# add a leading zero to the fips code
-merged_ori['fips'] = merged_ori['fips'].apply(lambda x: x.zfill(5))
-pop['fips'] = pop['fips'].apply(lambda x: x.zfill(5))
+# zero pad the population fips codes the same way as the crosswalk ones
+pop["fips"] = normalize_fips(pop.fips_state_county_code)
 
 # %%
 # check to make sure it worked
-merged_ori.fips.unique()
+crosswalk.fips.unique()
 
 # %%
 pop.fips.unique()
 
 # %%
-# merge all offenses to general offense table to get offense category name
-merged_offenses = pd.merge(all_offenses,offense_type[['OFFENSE_TYPE_ID','OFFENSE_CATEGORY_NAME']],on='OFFENSE_TYPE_ID', how='left', validate='m:m', indicator=True)
+# only the agencies of the counties we have population for are needed
+agency_ids = crosswalk.index[crosswalk["fips"].isin(pop["fips"])]
 
 # %%
-# check to make sure it worked
-merged_offenses._merge.value_counts()
+# stream 2019 and 2020 incidents and offenses, keeping only those agencies
+all_incidents = read_filtered_csv([os.path.join(DATA_PATH, f"{year}_NIBRS_incident.csv") for year in (2019, 2020)], INCIDENT_COLS, "AGENCY_ID", agency_ids)
+all_offenses = read_filtered_csv([os.path.join(DATA_PATH, f"{year}_NIBRS_offense.csv") for year in (2019, 2020)], OFFENSE_COLS, "INCIDENT_ID", all_incidents["INCIDENT_ID"])
 
 # %%
-# merge all incidents to the fips code
-merged_incidents = pd.merge(all_incidents,merged_ori[['AGENCY_ID','COUNTY_NAME','fips']],on='AGENCY_ID', how='left', validate='m:1', indicator=True)
+# dense integer keys instead of merges: the row of each offense's incident
+# and the row of each incident's agency in the crosswalk (-1 when missing)
+incident_ids = pd.Index(all_incidents["INCIDENT_ID"])
+offense_incident = incident_ids.get_indexer(all_offenses["INCIDENT_ID"])
+incident_agency = agency_codes(crosswalk, all_incidents["AGENCY_ID"])
 
 # %%
-# check how many agencies do not have a fips code
-merged_incidents._merge.value_counts()
+# check how many incidents do not have a fips code
+(incident_agency == -1).sum()
 
 # %%
-merged_incidents[merged_incidents._merge == 'left_only'].COUNTY_NAME.unique()
+# resolve the offense category name through an array indexed by OFFENSE_TYPE_ID
+offense_category, category_names = offense_categories(offense_type, all_offenses["OFFENSE_TYPE_ID"])
 
 # %%
-# merge all incidents to all offenses to get the offense category name
-# ***there can be multiple offenses per incident***
-merged_crimes = pd.merge(merged_incidents.drop('_merge', axis=1),merged_offenses[['INCIDENT_ID','OFFENSE_CATEGORY_NAME']],on='INCIDENT_ID', how='left', indicator=True, validate='m:m')
+# check how many offenses did not get a category
+(offense_category == -1).sum()
 
 # %%
-# grab month out of incident date to be used for aggregation
-merged_crimes["month"] = merged_crimes.INCIDENT_DATE.str[3:6]
+# identify crime as violent(1) or non-violent(0): an incident is violent when
+# any of its offenses is
+has_incident = offense_incident != -1
+offense_incident, offense_category = offense_incident[has_incident], offense_category[has_incident]
+any_violent, any_non_violent, first_category = classify_incidents(offense_incident, offense_category, len(incident_ids), np.isin(category_names, VIOLENT_CATEGORIES))
 
 # %%
-# create list of what are considered violent crimes
-violent_crimes = ['Burglary/Breaking & Entering','Assault Offenses','Arson','Robbery','Sex Offenses','Animal Cruelty','Homicide Offenses','Kidnapping/Abduction','Sex Offenses, Non-forcible','Human Trafficking']
+# check how many incidents fall in both violent and non-violent categories
+(any_violent & any_non_violent).sum()
 
 # %%
-# check cases where an incident falls in both violent and non-violent categories
-violent_incidents = merged_crimes[merged_crimes["OFFENSE_CATEGORY_NAME"].isin(violent_crimes)].INCIDENT_ID
-non_violent_incidents = merged_crimes[~merged_crimes["OFFENSE_CATEGORY_NAME"].isin(violent_crimes)].INCIDENT_ID
-both_v_and_nonv = merged_crimes[merged_crimes["INCIDENT_ID"].isin(violent_incidents) & merged_crimes["INCIDENT_ID"].isin(non_violent_incidents)].INCIDENT_ID.unique()
+# one row per incident with the keys of the aggregation; the month is taken
+# out of the parsed incident date and the fips code is the crosswalk's
+# category code
+fips_codes = np.append(crosswalk["fips"].cat.codes.to_numpy(), -1)[incident_agency]
+incident_dates = parse_incident_dates(all_incidents["INCIDENT_DATE"])
+incidents = crime_schema(pd.DataFrame({
+    "month": month_labels(incident_dates, abbreviated=True),
+    "DATA_YEAR": all_incidents["DATA_YEAR"].to_numpy(),
+    "fips": pd.Categorical.from_codes(fips_codes, dtype=crosswalk["fips"].dtype),
+    "violent_crime": any_violent.astype(np.int8),
+}))
+incident_group = incidents.groupby(list(incidents.columns), sort=False, dropna=False, observed=True).ngroup().to_numpy()
+groups = incidents.drop_duplicates().reset_index(drop=True)
 
 # %%
-# create new column to identify crime as violent(1) or non-violent(0)
-merged_crimes["violent_crime"] = 1
-merged_crimes.loc[~merged_crimes["INCIDENT_ID"].isin(both_v_and_nonv) & merged_crimes["INCIDENT_ID"].isin(non_violent_incidents), "violent_crime"] = 0
+# aggregate crimes by month, year, fips code, and offense category name: every
+# incident counts once under its first offense's category, and every other
+# category that appears in the group is kept with its (possibly zero) count
+with stage("crime_data_cleaning.aggregate", len(incidents)) as record:
+    n_categories = len(category_names)
+    counted = first_category != -1
+    crime_count = np.bincount(incident_group[counted] * n_categories + first_category[counted], minlength=len(groups) * n_categories)
+    present = np.zeros(len(groups) * n_categories, dtype=bool)
+    known = offense_category != -1
+    present[incident_group[offense_incident[known]] * n_categories + offense_category[known]] = True
+    cells = np.flatnonzero(present)
 
-# %%
-merged_crimes["duplicated_incident"] = merged_crimes.duplicated(subset=['INCIDENT_ID'])
-
-# %%
-# create new column to aggreagrate all incidents
-merged_crimes["crime_count"] = np.where(merged_crimes["duplicated_incident"] == False, 1, 0)
-
-# %%
-# aggregate crimes by month, year, fips code, and offense category name
-final_crimes = merged_crimes.groupby(["month","DATA_YEAR","fips","OFFENSE_CATEGORY_NAME","violent_crime"]).agg({"crime_count":"sum"}).reset_index()
+    final_crimes = groups.iloc[cells // n_categories].reset_index(drop=True)
+    final_crimes.insert(3, "OFFENSE_CATEGORY_NAME", pd.Categorical.from_codes(cells % n_categories, category_names))
+    final_crimes["crime_count"] = crime_count[cells]
+    final_crimes = crime_schema(final_crimes)
+    final_crimes = final_crimes.dropna(subset=["fips"]).sort_values(["month","DATA_YEAR","fips","OFFENSE_CATEGORY_NAME","violent_crime"]).reset_index(drop=True)
+    record["rows_out"] = len(final_crimes)
 
 # %%
 # aggregate crimes by month, year, fips code, and whether it is a violent crime
-final_crimes.groupby(["month","DATA_YEAR","fips","violent_crime"]).agg({"crime_count":"sum"}).reset_index()
-
-# %%
-# grab only the first three letters of the month column in pop data
-pop["month"] = pop.month.str[0:3].str.upper()
+final_crimes.groupby(["month","DATA_YEAR","fips","violent_crime"], observed=True).agg({"crime_count":"sum"}).reset_index()
 
 # %%
-# change it to an integer for merging
-pop["DATA_YEAR"] = pop.year.astype(int)
+# same keys and compact dtypes as final_crimes for merging: abbreviated month
+# categorical, small integer year and categorical fips codes
+pop["DATA_YEAR"] = pop.year
+pop = crime_schema(pop)
+final_crimes, pop = align_categories([final_crimes, pop], ["fips"])
 
 # %%
 # merge population data to get population for each fips code
-merged_pop = pd.merge(final_crimes,pop.drop(['year','fips_state_county_code'], axis=1), on=["fips","month","DATA_YEAR"], how="inner")
+with stage("crime_data_cleaning.merge_population", len(final_crimes)) as record:
+    merged_pop = pd.merge(final_crimes,pop.drop(['year','fips_state_county_code'], axis=1), on=["fips","month","DATA_YEAR"], how="inner")
+    record["rows_out"] = len(merged_pop)
 
 # %%
 # create a new column to calculate the crime rate per 100,000 people
@@ -141,6 +136,7 @@ merged_pop["crime_rate"] = (merged_pop.crime_count/merged_pop.population)*100000
 
 # %%
 # push merged_pop table to repo as csv
-merged_pop.to_csv("/mnt/c/Users/sdona/Documents/Duke/22Spring/701IDS/FinalProject/uds-2022-701-team-5/20_intermediate_files/crime_rate.csv", index=False)
+with stage("crime_data_cleaning.write", len(merged_pop)):
+    merged_pop.to_csv(os.path.join(INTERMEDIATE_PATH, "crime_rate.csv"), index=False)
 
 
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+from instrument import instrumented
+
+
+# Agencies whose county is missing in the arrest data, keyed by agency name
+FIPS_OVERRIDES = {"us secret service, denve": "08031"}
+
+
+def normalize_ori(ori):
+    """
+    UCR arrest ORIs have 7 characters, NIBRS ORIs have 9: the two trailing
+    zeros are added to every ORI at once.
+
+    :param ori: series of ORI numbers
+    :return: series of 9 character, upper case ORI numbers
+    """
+    return ori.astype(str).str.strip().str.upper().str.ljust(9, "0")
+
+
+def normalize_fips(fips):
+    """
+    Turn county FIPS codes read as strings, ints or floats (e.g. "08031",
+    8031, 8031.0) into 5 character strings. Empty codes become NaN.
+
+    :param fips: series of FIPS codes
+    :return: series of zero padded FIPS codes, categorical if fips is
+    """
+    if isinstance(fips.dtype, pd.CategoricalDtype):
+        # Normalize every distinct code once, "8031" and "08031" merge
+        categories = normalize_fips(pd.Series(fips.cat.categories))
+        codes, uniques = pd.factorize(categories, sort=True)
+        codes = np.append(codes, -1)[fips.cat.codes]
+        return pd.Series(
+            pd.Categorical.from_codes(codes, uniques), index=fips.index, name=fips.name
+        )
+
+    codes = pd.to_numeric(fips.replace("", np.nan), errors="coerce").astype("Int64")
+    return codes.astype(str).str.zfill(5).where(codes.notna().to_numpy(), np.nan)
+
+
+def impute_fips(df):
+    """
+    Fill the missing county FIPS codes of the agencies in FIPS_OVERRIDES.
+
+    :param df: arrest data with agency_name and fips_state_county_code
+    :return: the FIPS codes with the known gaps filled
+    """
+    fips = df["fips_state_county_code"]
+    missing = fips.isna() | (fips == "")
+    overrides = df["agency_name"].map(FIPS_OVERRIDES)
+    if isinstance(fips.dtype, pd.CategoricalDtype):
+        new = set(overrides.dropna()) - set(fips.cat.categories)
+        fips = fips.cat.add_categories(sorted(new))
+    return fips.where(~(missing & overrides.notna()), overrides)
+
+
+@instrumented()
+def build_crosswalk(arrests, agencies):
+    """
+    One row per NIBRS agency with its ORI, county FIPS code, county name and
+    a dense integer code per county, indexed by AGENCY_ID.
+
+    :param arrests: arrest data with ori and fips_state_county_code
+    :param agencies: NIBRS agencies table with ORI, AGENCY_ID and COUNTY_NAME
+    :return: the crosswalk
+    """
+    ori = arrests[["ori", "fips_state_county_code"]].drop_duplicates()
+    ori = pd.DataFrame(
+        {
+            "ORI": normalize_ori(ori["ori"]),
+            "fips": normalize_fips(ori["fips_state_county_code"]),
+        }
+    ).dropna(subset=["fips"])
+
+    agencies = agencies[["AGENCY_ID", "ORI", "COUNTY_NAME"]].drop_duplicates(
+        subset=["AGENCY_ID"]
+    )
+    agencies = agencies.assign(ORI=normalize_ori(agencies["ORI"]))
+
+    crosswalk = pd.merge(agencies, ori, on="ORI", how="inner")
+    crosswalk = crosswalk.drop_duplicates(subset=["AGENCY_ID"])
+    crosswalk["county_code"] = pd.factorize(crosswalk["fips"], sort=True)[0]
+    return crosswalk.set_index("AGENCY_ID").sort_index()
+
+
+def save_crosswalk(crosswalk, path):
+    """
+
+    :param crosswalk: crosswalk from build_crosswalk
+    :param path: Parquet file to write
+    """
+    crosswalk.to_parquet(path)
+
+
+def load_crosswalk(path):
+    """
+
+    :param path: Parquet file written by save_crosswalk
+    :return: the crosswalk, indexed by AGENCY_ID
+    """
+    return pd.read_parquet(path)
+
+
+def agency_codes(crosswalk, agency_ids):
+    """
+
+    :param crosswalk: crosswalk from build_crosswalk
+    :param agency_ids: AGENCY_IDs to look up
+    :return: row of every agency in the crosswalk, -1 for unknown agencies
+    """
+    return crosswalk.index.get_indexer(agency_ids)
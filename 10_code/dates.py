@@ -0,0 +1,135 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import MONTH_ABBREVIATION_DTYPE, MONTH_DTYPE, month_categories
+
+
+NIBRS_DATE_FORMAT = "%d-%b-%y"
+
+
+def month_numbers(month):
+    """
+    Month numbers of month names in any case, full ("january") or
+    abbreviated ("JAN"), or of month numbers. Names are looked up once per
+    distinct value, see schema.month_categories.
+
+    :param month: series of month names or numbers
+    :return: int64 array of month numbers, 1 to 12, 0 for unknown months
+    """
+    if pd.api.types.is_numeric_dtype(month.dtype):
+        numbers = np.asarray(month, dtype=np.int64)
+        return np.where((numbers >= 1) & (numbers <= 12), numbers, 0)
+    return month_categories(month).cat.codes.to_numpy().astype(np.int64) + 1
+
+
+def month_ordinals(year, month):
+    """
+
+    :param year: series or array of years
+    :param month: series of month names or numbers, see month_numbers
+    :return: months since January 1970, NaT's integer value for unknown
+        months
+    """
+    numbers = month_numbers(month)
+    ordinals = (np.asarray(year, dtype=np.int64) - 1970) * 12 + numbers - 1
+    ordinals[numbers == 0] = np.iinfo(np.int64).min
+    return ordinals
+
+
+def monthly_periods(year, month):
+    """
+
+    :param year: series or array of years
+    :param month: series of month names or numbers, see month_numbers
+    :return: monthly PeriodIndex, NaT for unknown months
+    """
+    return pd.PeriodIndex(pd.arrays.PeriodArray(month_ordinals(year, month), freq="M"))
+
+
+def month_starts(year, month):
+    """
+    First day of every month, computed with integer arithmetic instead of
+    formatting and parsing date strings.
+
+    :param year: series or array of years
+    :param month: series of month names or numbers, see month_numbers
+    :return: datetime64[ns] array, NaT for unknown months
+    """
+    ordinals = month_ordinals(year, month)
+    return ordinals.astype("datetime64[M]").astype("datetime64[ns]")
+
+
+def month_labels(dates, abbreviated=False):
+    """
+
+    :param dates: datetime64 array or series
+    :param abbreviated: use MONTH_ABBREVIATION_DTYPE instead of MONTH_DTYPE
+    :return: ordered month categorical of every date, NaN for NaT
+    """
+    months = np.asarray(dates, dtype="datetime64[M]")
+    codes = months.astype(np.int64) % 12
+    codes[np.isnat(months)] = -1
+    dtype = MONTH_ABBREVIATION_DTYPE if abbreviated else MONTH_DTYPE
+    return pd.Categorical.from_codes(codes, dtype=dtype)
+
+
+def parse_incident_dates(dates, date_format=NIBRS_DATE_FORMAT):
+    """
+    Parse NIBRS INCIDENT_DATE strings such as "05-JAN-19". The incidents of
+    a year fall on a few hundred distinct days, so every distinct string is
+    parsed once and the result is gathered back by its code.
+
+    :param dates: series of date strings
+    :param date_format: strftime format of the strings
+    :return: datetime64[ns] array, NaT for missing dates
+    """
+    codes, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(uniques, format=date_format).to_numpy()
+    return np.append(parsed, np.datetime64("NaT", "ns"))[codes]
+
+
+def benchmark(rows, seed=0):
+    """
+    Time the lookup functions against the string formatting and parsing
+    they replace.
+
+    :param rows: number of rows
+    :param seed: seed of the random dates
+    :return: {name: seconds}
+    """
+    rng = np.random.default_rng(seed)
+    days = np.datetime64("1991-01-01") + rng.integers(0, 30 * 365, rows)
+    series = pd.Series(days)
+    year = pd.Series(series.dt.year.to_numpy())
+    month = pd.Series(series.dt.month_name().str.lower())
+    incident = pd.Series(series.dt.strftime("%d-%b-%y").str.upper())
+
+    cases = {
+        "month_starts": lambda: month_starts(year, month),
+        "string month_starts": lambda: pd.to_datetime(
+            year.astype(str) + "-" + month.str.capitalize() + "-01",
+            format="%Y-%B-%d",
+        ),
+        "parse_incident_dates": lambda: parse_incident_dates(incident),
+        "string parse_incident_dates": lambda: pd.to_datetime(
+            incident, format=NIBRS_DATE_FORMAT
+        ),
+    }
+    timings = {}
+    for name, case in cases.items():
+        start = time.perf_counter()
+        case()
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the date utilities")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    for name, seconds in benchmark(args.rows).items():
+        print(f"{name}: {seconds:.2f} s")
@@ -0,0 +1,624 @@
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from scipy import stats
+
+from instrument import instrumented
+
+
+RESULT_COLUMNS = [
+    "coefficient name",
+    "coef",
+    "std err",
+    "t",
+    "p-value",
+    "0.025",
+    "0.975",
+    "independent variable",
+]
+
+
+def within_transform(values, entity, time, tol=1e-10, max_iter=1000):
+    """
+    Remove entity and time fixed effects from every column at once by
+    alternating between the entity and time demeaning. A balanced panel
+    converges after one sweep, unbalanced panels after a few.
+
+    :param values: n x k array
+    :param entity: integer entity code of every row
+    :param time: integer time code of every row
+    :param tol: largest change in a sweep that counts as converged
+    :param max_iter: maximum number of sweeps
+    :return: the demeaned n x k array
+    """
+    values = np.array(values, dtype=float)
+    entity_n = np.bincount(entity)[:, None]
+    time_n = np.bincount(time)[:, None]
+    for _ in range(max_iter):
+        previous = values.copy()
+        for codes, counts in ((entity, entity_n), (time, time_n)):
+            sums = np.zeros((counts.shape[0], values.shape[1]))
+            np.add.at(sums, codes, values)
+            values -= (sums / counts)[codes]
+        if np.max(np.abs(values - previous), initial=0.0) < tol:
+            break
+    return values
+
+
+def not_absorbed(x, tol=1e-8):
+    """
+
+    :param x: n x k within transformed regressors
+    :param tol: relative residual norm below which a column is absorbed
+    :return: positions of the columns that are not absorbed by the fixed
+        effects or collinear with an earlier column
+    """
+    keep = []
+    for col in range(x.shape[1]):
+        norm = np.linalg.norm(x[:, col])
+        if norm <= tol:
+            continue
+        if keep:
+            basis = x[:, keep]
+            coef = np.linalg.lstsq(basis, x[:, col], rcond=None)[0]
+            if np.linalg.norm(x[:, col] - basis @ coef) <= tol * norm:
+                continue
+        keep.append(col)
+    return keep
+
+
+def cluster_covariance(x, resid, clusters, xpxi, scale=1.0):
+    """
+    Cluster robust covariance of every outcome at once.
+
+    :param x: n x k regressors
+    :param resid: n x m residuals, one column per outcome
+    :param clusters: integer cluster code of every row
+    :param xpxi: inverse of x'x
+    :param scale: small sample scale applied to the meat
+    :return: m x k x k covariance matrices
+    """
+    n_clusters = clusters.max() + 1
+    scores = np.zeros((n_clusters, x.shape[1], resid.shape[1]))
+    np.add.at(scores, clusters, x[:, :, None] * resid[:, None, :])
+    meat = np.einsum("gkm,glm->mkl", scores, scores) * scale
+    return xpxi @ meat @ xpxi
+
+
+def kernel_covariance(x, resid, time, xpxi, scale=1.0, bandwidth=None):
+    """
+    Driscoll-Kraay covariance of every outcome at once: the scores are summed
+    within each period and the period sums are weighted with a Bartlett
+    kernel, as PanelOLS does for cov_type="kernel".
+
+    :param x: n x k regressors
+    :param resid: n x m residuals, one column per outcome
+    :param time: integer time code of every row, in time order
+    :param xpxi: inverse of x'x
+    :param scale: small sample scale applied to the meat
+    :param bandwidth: number of lags, defaults to floor(4 (T / 100) ^ (2 / 9))
+    :return: m x k x k covariance matrices
+    """
+    n_times = time.max() + 1
+    if bandwidth is None:
+        bandwidth = np.floor(4 * (n_times / 100) ** (2 / 9))
+    bandwidth = int(bandwidth)
+    scores = np.zeros((n_times, x.shape[1], resid.shape[1]))
+    np.add.at(scores, time, x[:, :, None] * resid[:, None, :])
+
+    meat = np.einsum("tkm,tlm->mkl", scores, scores)
+    for lag in range(1, min(bandwidth, n_times - 1) + 1):
+        cross = np.einsum("tkm,tlm->mkl", scores[lag:], scores[:-lag])
+        meat += (1 - lag / (bandwidth + 1)) * (cross + cross.transpose(0, 2, 1))
+    return xpxi @ (meat * scale) @ xpxi
+
+
+def design(df, outcomes, regressors, entity=None, time=None):
+    """
+    Within transformed regressors and outcomes of a two-way fixed effects
+    regression.
+
+    :param df: panel with an (entity, time) MultiIndex
+    :param outcomes: outcome columns
+    :param regressors: regressor columns; "a:b" is the product of a and b.
+        Regressors absorbed by the fixed effects are dropped
+    :param entity: entity of every row, defaults to index level 0
+    :param time: time of every row, defaults to index level 1
+    :return: (x, y, regressor names, entity codes, time codes in time order,
+        residual degrees of freedom)
+    """
+    entity = df.index.get_level_values(0) if entity is None else entity
+    time = df.index.get_level_values(1) if time is None else time
+    entity_codes, entities = pd.factorize(np.asarray(entity))
+    time_codes, times = pd.factorize(np.asarray(time), sort=True)
+
+    x = np.column_stack(
+        [np.prod([df[part] for part in name.split(":")], axis=0) for name in regressors]
+    ).astype(float)
+    y = df[list(outcomes)].to_numpy(dtype=float)
+    demeaned = within_transform(np.hstack([x, y]), entity_codes, time_codes)
+    x, y = demeaned[:, : x.shape[1]], demeaned[:, x.shape[1] :]
+
+    keep = not_absorbed(x)
+    names = [regressors[col] for col in keep]
+    x = x[:, keep]
+
+    df_resid = x.shape[0] - x.shape[1] - (len(entities) + len(times) - 1)
+    return x, y, names, entity_codes, time_codes, df_resid
+
+
+@instrumented()
+def fit(df, outcomes, regressors, cov_type="clustered", entity=None, time=None):
+    """
+    Two-way (entity and time) fixed effects regression of every outcome on
+    the same regressors. The design is within transformed once, and all
+    outcomes are solved in one multi column least squares call, so this
+    gives the same estimates as one PanelOLS fit per outcome with
+    EntityEffects + TimeEffects.
+
+    :param df: panel with an (entity, time) MultiIndex
+    :param outcomes: outcome columns
+    :param regressors: regressor columns; "a:b" is the product of a and b.
+        Regressors absorbed by the fixed effects are dropped
+    :param cov_type: "clustered" (by entity), "robust", "kernel"
+        (Driscoll-Kraay) or "unadjusted"
+    :param entity: entity of every row, defaults to index level 0
+    :param time: time of every row, defaults to index level 1
+    :return: tidy results frame with one row per outcome and regressor
+    """
+    x, y, names, entity_codes, time_codes, df_resid = design(
+        df, outcomes, regressors, entity, time
+    )
+    params, *_ = np.linalg.lstsq(x, y, rcond=None)
+    resid = y - x @ params
+    nobs = x.shape[0]
+    xpxi = np.linalg.inv(x.T @ x)
+
+    # Same degrees of freedom adjustment for the absorbed effects as PanelOLS
+    scale = nobs / df_resid
+    if cov_type == "clustered":
+        cov = cluster_covariance(x, resid, entity_codes, xpxi, scale)
+    elif cov_type == "robust":
+        cov = cluster_covariance(x, resid, np.arange(nobs), xpxi, scale)
+    elif cov_type == "kernel":
+        cov = kernel_covariance(x, resid, time_codes, xpxi, scale)
+    elif cov_type == "unadjusted":
+        sigma2 = (resid**2).sum(axis=0) / nobs * scale
+        cov = sigma2[:, None, None] * xpxi
+    else:
+        raise ValueError(f"Unknown cov_type {cov_type!r}")
+
+    return results_frame(names, outcomes, params, cov, df_resid)
+
+
+def results_frame(names, outcomes, params, cov, df_resid):
+    """
+
+    :param names: regressor names
+    :param outcomes: outcome names
+    :param params: k x m estimates
+    :param cov: m x k x k covariance matrices
+    :param df_resid: residual degrees of freedom of the t distribution
+    :return: tidy results frame with one row per outcome and regressor
+    """
+    # A variance that is not positive (0 or negative up to round off) means
+    # the coefficient is not identified, its inference is left missing
+    variance = np.diagonal(cov, axis1=1, axis2=2)
+    std_err = np.sqrt(np.where(variance > 0, variance, np.nan)).T
+    t = params / std_err
+    crit = stats.t.ppf(0.975, df_resid)
+    return pd.DataFrame(
+        {
+            "coefficient name": np.tile(names, len(outcomes)),
+            "coef": params.T.ravel(),
+            "std err": std_err.T.ravel(),
+            "t": t.T.ravel(),
+            "p-value": (2 * stats.t.sf(np.abs(t), df_resid)).T.ravel(),
+            "0.025": (params - crit * std_err).T.ravel(),
+            "0.975": (params + crit * std_err).T.ravel(),
+            "independent variable": np.repeat(list(outcomes), len(names)),
+        },
+        columns=RESULT_COLUMNS,
+    )
+
+
+# Two point and six point distributions of the wild bootstrap weights
+BOOTSTRAP_WEIGHTS = {
+    "rademacher": np.array([-1.0, 1.0]),
+    "webb": np.array(
+        [-np.sqrt(1.5), -1.0, -np.sqrt(0.5), np.sqrt(0.5), 1.0, np.sqrt(1.5)]
+    ),
+}
+
+
+def enumerates(n_clusters, weights="rademacher", draws=None, max_draws=2**20):
+    """
+
+    :param n_clusters: number of clusters
+    :param weights: "rademacher" or "webb"
+    :param draws: number of sampled draws, None enumerates when possible
+    :param max_draws: largest number of combinations that is enumerated
+    :return: True if bootstrap_weights enumerates every combination, False
+        if it samples draws
+    """
+    return draws is None and len(BOOTSTRAP_WEIGHTS[weights]) ** n_clusters <= max_draws
+
+
+def bootstrap_weights(
+    n_clusters, weights="rademacher", draws=None, max_draws=2**20, seed=0
+):
+    """
+    One row of cluster weights per bootstrap draw. When the distribution has
+    few enough combinations (2^7 Rademacher or 6^7 Webb draws for 7
+    clusters) every combination is enumerated, otherwise draws are sampled.
+
+    :param n_clusters: number of clusters
+    :param weights: "rademacher" or "webb"
+    :param draws: number of sampled draws, None enumerates when possible
+    :param max_draws: largest number of combinations that is enumerated
+    :param seed: seed of the sampled draws
+    :return: draws x n_clusters weights matrix
+    """
+    values = BOOTSTRAP_WEIGHTS[weights]
+    if enumerates(n_clusters, weights, draws, max_draws):
+        return np.array(list(product(values, repeat=n_clusters)))
+    rng = np.random.default_rng(seed)
+    return rng.choice(values, size=(draws or 9999, n_clusters))
+
+
+def cluster_sums(values, clusters):
+    """
+
+    :param values: n x ... array
+    :param clusters: integer cluster code of every row
+    :return: sums of values within each cluster
+    """
+    sums = np.zeros((clusters.max() + 1,) + values.shape[1:])
+    np.add.at(sums, clusters, values)
+    return sums
+
+
+@instrumented()
+def wild_cluster_bootstrap(
+    df,
+    outcomes,
+    regressors,
+    coefficient="treatment:post_treatment",
+    weights="rademacher",
+    draws=None,
+    seed=0,
+):
+    """
+    Wild cluster restricted bootstrap (WCR) p-value of one coefficient for
+    every outcome, clustering by entity. The null of a zero coefficient is
+    imposed, the restricted residuals are flipped by cluster, and the
+    bootstrap t statistics of all draws and outcomes come out of a few
+    matrix products over the weights matrix instead of one refit per draw.
+
+    :param df: panel with an (entity, time) MultiIndex
+    :param outcomes: outcome columns
+    :param regressors: regressor columns, see fit
+    :param coefficient: regressor that is tested
+    :param weights: "rademacher" or "webb"
+    :param draws: number of sampled draws, None enumerates when possible
+    :param seed: seed of the sampled draws
+    :return: one row per outcome with the estimate, its cluster robust t
+        statistic and the bootstrap p-value
+    """
+    x, y, names, clusters, _, df_resid = design(df, outcomes, regressors)
+    if coefficient not in names:
+        raise ValueError(f"{coefficient!r} is absorbed by the fixed effects")
+    j = names.index(coefficient)
+    n_clusters = clusters.max() + 1
+    scale = x.shape[0] / df_resid
+
+    xpxi = np.linalg.inv(x.T @ x)
+    a = xpxi @ x.T
+    params = a @ y
+    resid = y - x @ params
+
+    # Cluster robust t statistic from the cluster sums of a_j * residual
+    t_stat = params[j] / np.sqrt(
+        scale * (cluster_sums(a[j][:, None] * resid, clusters) ** 2).sum(axis=0)
+    )
+
+    restricted = np.delete(x, j, axis=1)
+    resid_r = y - restricted @ np.linalg.lstsq(restricted, y, rcond=None)[0]
+
+    # y* = fitted_r + v * resid_r, so beta* = V @ (cluster sums of a resid_r)
+    # and the cluster sums of a_j * u* are v_g c_g - e_g . beta*
+    v = bootstrap_weights(n_clusters, weights, draws, seed=seed)
+    d = cluster_sums(a.T[:, :, None] * resid_r[:, None, :], clusters)
+    e = cluster_sums(a[j][:, None] * x, clusters)
+    beta = np.einsum("bg,gkm->bkm", v, d)
+    scores = v[:, :, None] * d[None, :, j, :] - np.einsum("gk,bkm->bgm", e, beta)
+    t_boot = beta[:, j, :] / np.sqrt(scale * (scores**2).sum(axis=1))
+
+    # Enumerated draws include the original sample (all weights 1), whose t
+    # statistic ties with t_stat up to rounding, so ties count as exceedances
+    p_value = (np.abs(t_boot) >= np.abs(t_stat) * (1 - 1e-9)).mean(axis=0)
+    return pd.DataFrame(
+        {
+            "independent variable": list(outcomes),
+            "coefficient name": coefficient,
+            "coef": params[j],
+            "t": t_stat,
+            "p-value": p_value,
+            "weights": weights,
+            "draws": v.shape[0],
+        }
+    )
+
+
+@instrumented()
+def randomization_inference(
+    df, outcomes, date="date", entities=None, policy_dates=None, batch_size=64
+):
+    """
+    Null distribution of the DiD interaction estimate: treatment is moved to
+    every entity and every candidate policy date, and the two-way fixed
+    effects regression of each outcome on post and treatment:post is
+    estimated for every assignment.
+
+    The outcomes are within transformed once. The post dummies and the
+    interactions of a batch of entities are within transformed together,
+    and the interaction coefficient of every assignment is the
+    Frisch-Waugh-Lovell ratio z'y / z'z, with z the interaction net of post.
+
+    :param df: panel with an (entity, time) MultiIndex
+    :param outcomes: outcome columns
+    :param date: column with the date of every row
+    :param entities: entities that receive the placebo treatment, defaults
+        to every entity in the panel
+    :param policy_dates: candidate policy dates, defaults to every date but
+        the first
+    :param batch_size: number of entities whose interactions are transformed
+        at once
+    :return: one row per entity, policy date and outcome with the estimate,
+        assignments absorbed by the fixed effects are left out
+    """
+    entity = np.asarray(df.index.get_level_values(0))
+    entity_codes, entity_names = pd.factorize(entity)
+    time_codes = pd.factorize(np.asarray(df.index.get_level_values(1)))[0]
+    dates = df[date].to_numpy()
+    entities = entity_names if entities is None else np.asarray(entities)
+    if policy_dates is None:
+        policy_dates = np.unique(dates)[1:]
+    policy_dates = np.asarray(policy_dates, dtype=dates.dtype)
+
+    y = within_transform(df[list(outcomes)], entity_codes, time_codes)
+    post = within_transform(
+        dates[:, None] >= policy_dates[None, :], entity_codes, time_codes
+    )
+    post_norm = (post**2).sum(axis=0)
+
+    results = []
+    for start in range(0, len(entities), batch_size):
+        batch = entities[start : start + batch_size]
+        treated = entity[:, None] == batch[None, :]
+        interaction = treated[:, :, None] & (dates[:, None] >= policy_dates)[:, None, :]
+        n_assignments = len(batch) * len(policy_dates)
+        z = within_transform(
+            interaction.reshape(len(entity), n_assignments), entity_codes, time_codes
+        ).reshape(interaction.shape)
+
+        # Partial post out of the interaction of the same policy date
+        overlap = np.einsum("nep,np->ep", z, post)
+        z -= post[:, None, :] * np.divide(
+            overlap, post_norm, out=np.zeros_like(overlap), where=post_norm > 1e-8
+        )
+        z_norm = np.einsum("nep,nep->ep", z, z)
+        coef = np.einsum("nep,nm->epm", z, y) / z_norm[:, :, None]
+
+        keep = z_norm > 1e-8
+        placebo, policy = np.nonzero(keep)
+        results.append(
+            pd.DataFrame(
+                {
+                    "entity": np.repeat(batch[placebo], len(outcomes)),
+                    "policy date": np.repeat(policy_dates[policy], len(outcomes)),
+                    "independent variable": np.tile(list(outcomes), len(placebo)),
+                    "coef": coef[keep].ravel(),
+                }
+            )
+        )
+    return pd.concat(results, ignore_index=True)
+
+
+def randomization_p_values(null, observed):
+    """
+
+    :param null: null distribution from randomization_inference
+    :param observed: {outcome: estimate of the actual assignment}
+    :return: one row per outcome with the estimate, the share of placebo
+        estimates at least as large in absolute value and the number of
+        placebo assignments
+    """
+    observed = pd.Series(observed, name="coef")
+    threshold = observed.abs().reindex(null["independent variable"]).to_numpy()
+    extreme = null["coef"].abs() >= threshold * (1 - 1e-9)
+    grouped = extreme.groupby(null["independent variable"])
+    return (
+        pd.DataFrame(
+            {
+                "coef": observed,
+                "p-value": grouped.mean(),
+                "permutations": grouped.size(),
+            }
+        )
+        .reindex(observed.index)
+        .rename_axis("independent variable")
+        .reset_index()
+    )
+
+
+@instrumented()
+def event_study(
+    df,
+    outcomes,
+    relative="relative_month",
+    treatment="treatment",
+    reference=-1,
+    cov_type="clustered",
+    weights="rademacher",
+    draws=None,
+    seed=0,
+    degenerate="raise",
+):
+    """
+    Event study of every outcome: one indicator per month relative to the
+    start of the treatment, for the treated entities, with entity and time
+    fixed effects. All leads and lags of all outcomes come out of one least
+    squares solve.
+
+    With cov_type="bootstrap" the intervals come from a wild cluster
+    bootstrap of every coefficient at once: the bootstrap deviations of all
+    draws are the weights matrix times the cluster sums of the residuals.
+
+    :param df: panel with an (entity, time) MultiIndex
+    :param outcomes: outcome columns
+    :param relative: column with the months since the start of the treatment
+    :param treatment: column that is 1 for the treated entities
+    :param reference: relative month left out as the baseline
+    :param cov_type: "clustered" (by entity) or "bootstrap"
+    :param weights: bootstrap weights, see bootstrap_weights
+    :param draws: number of sampled bootstrap draws, None enumerates when
+        possible
+    :param seed: seed of the sampled draws
+    :param degenerate: what to do with a lead or lag that has no variance
+        across the clusters: "raise" a ValueError, or leave its "missing"
+        standard error, p-value and interval as NaN
+    :return: tidy results frame with the relative month of every row
+    """
+    if degenerate not in ("raise", "missing"):
+        raise ValueError(f"Unknown degenerate {degenerate!r}")
+    treated = df[treatment].to_numpy() == 1
+    months = sorted(set(df.loc[treated, relative]) - {reference})
+    indicators = {
+        f"relative_month_{month}": (treated & (df[relative] == month).to_numpy())
+        for month in months
+    }
+    panel = df[list(outcomes)].assign(**indicators)
+    x, y, names, clusters, _, df_resid = design(panel, outcomes, list(indicators))
+    absorbed = [name for name in indicators if name not in names]
+    if absorbed:
+        raise ValueError(f"{absorbed} are absorbed by the fixed effects")
+    params, *_ = np.linalg.lstsq(x, y, rcond=None)
+    resid = y - x @ params
+    xpxi = np.linalg.inv(x.T @ x)
+    scale = x.shape[0] / df_resid
+
+    if cov_type == "clustered":
+        cov = cluster_covariance(x, resid, clusters, xpxi, scale)
+        variance = np.diagonal(cov, axis1=1, axis2=2).T
+    elif cov_type == "bootstrap":
+        v = bootstrap_weights(clusters.max() + 1, weights, draws, seed=seed)
+        scores = cluster_sums((xpxi @ x.T).T[:, :, None] * resid[:, None, :], clusters)
+        deviations = np.einsum("bg,gkm->bkm", v, scores)
+        variance = deviations.var(axis=0)
+        exceed = (np.abs(deviations) >= np.abs(params)).sum(axis=0)
+        if enumerates(clusters.max() + 1, weights, draws):
+            p_value = exceed / v.shape[0]
+        else:
+            # A Monte Carlo p-value counts the observed statistic as one of
+            # the draws, so it is never 0
+            p_value = (exceed + 1) / (v.shape[0] + 1)
+    else:
+        raise ValueError(f"Unknown cov_type {cov_type!r}")
+
+    # A lead or lag has no variance across the clusters when its months are
+    # only observed for the treated entity (e.g. when the time index repeats
+    # every year), or when no other entity varies between its month and the
+    # reference month (e.g. a rare offense); its robust variance is then 0
+    # up to round off. An outcome the model fits exactly up to round off has
+    # no residuals at all, its inference is always left missing.
+    eps = np.finfo(float).eps
+    rss = (resid**2).sum(axis=0)
+    exact = rss <= eps * (y**2).sum(axis=0)
+    iid_variance = np.outer(np.diagonal(xpxi), rss / df_resid)
+    missing = ~(variance > np.sqrt(eps) * iid_variance) | exact
+    if degenerate == "raise" and (missing & ~exact).any():
+        coefficients = sorted({names[k] for k in np.nonzero(missing & ~exact)[0]})
+        raise ValueError(f"{coefficients} have no variance across the clusters")
+
+    if cov_type == "clustered":
+        results = results_frame(names, outcomes, params, cov, df_resid)
+    else:
+        std_err = np.sqrt(np.where(missing, np.nan, variance))
+        results = pd.DataFrame(
+            {
+                "coefficient name": np.tile(names, len(outcomes)),
+                "coef": params.T.ravel(),
+                "std err": std_err.T.ravel(),
+                "t": (params / std_err).T.ravel(),
+                "p-value": p_value.T.ravel(),
+                "0.025": (params - np.quantile(deviations, 0.975, axis=0)).T.ravel(),
+                "0.975": (params - np.quantile(deviations, 0.025, axis=0)).T.ravel(),
+                "independent variable": np.repeat(list(outcomes), len(names)),
+            },
+            columns=RESULT_COLUMNS,
+        )
+    inference = ["std err", "t", "p-value", "0.025", "0.975"]
+    results.loc[missing.T.ravel(), inference] = np.nan
+
+    offsets = {f"relative_month_{month}": month for month in months}
+    results.insert(1, "relative month", results["coefficient name"].map(offsets))
+    return results
+
+
+_GRID_DATASETS = {}
+
+
+def _init_grid_worker(datasets):
+    _GRID_DATASETS.update(datasets)
+
+
+def _fit_cell(datasets, cell):
+    dataset, outcomes, specification, regressors, cov_type = cell
+    results = fit(datasets[dataset], outcomes, regressors, cov_type=cov_type)
+    results.insert(0, "cov_type", cov_type)
+    results.insert(0, "specification", specification)
+    results.insert(0, "dataset", dataset)
+    return results
+
+
+def _fit_grid_cell(cell):
+    return _fit_cell(_GRID_DATASETS, cell)
+
+
+@instrumented()
+def fit_grid(
+    datasets, outcomes, specifications, cov_types=("clustered",), max_workers=None
+):
+    """
+    Fit every (dataset, specification, covariance) combination of the grid
+    on a process pool. The outcomes of a cell share one within transform and
+    one least squares solve, so a cell is the unit of work sent to a worker.
+    Each worker receives the datasets once, when it starts.
+
+    :param datasets: {dataset name: panel with an (entity, time) MultiIndex}
+    :param outcomes: outcome columns, present in every dataset
+    :param specifications: {specification name: regressor columns}
+    :param cov_types: covariance estimators, see fit
+    :param max_workers: number of processes, 1 fits the grid in this process
+    :return: tidy results frame with the dataset, specification and cov_type
+        of every row, in grid order whatever order the cells finish in
+    """
+    cells = [
+        (dataset, list(outcomes), specification, list(regressors), cov_type)
+        for dataset in datasets
+        for specification, regressors in specifications.items()
+        for cov_type in cov_types
+    ]
+    if max_workers == 1:
+        results = [_fit_cell(datasets, cell) for cell in cells]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_grid_worker,
+            initargs=(datasets,),
+        ) as executor:
+            results = list(executor.map(_fit_grid_cell, cells))
+    return pd.concat(results, ignore_index=True)
@@ -0,0 +1,192 @@
+import os
+import numpy as np
+import matplotlib.dates as mdates
+
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from scipy import stats
+
+from instrument import instrumented
+
+
+POLICY_DATE = "2020-06-01"
+
+
+def linear_fit_band(x, y, level=0.95):
+    """
+    Least squares line through (x, y) with the confidence band of its mean,
+    computed in closed form from the OLS covariance instead of bootstrap
+    resamples.
+
+    :param x: regressor values
+    :param y: outcome values
+    :param level: confidence level of the band
+    :return: (fitted values, lower bound, upper bound) at x
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Centering keeps X'X well conditioned for date numbers
+    design = np.column_stack([np.ones_like(x), x - x.mean()])
+    xpxi = np.linalg.inv(design.T @ design)
+    fitted = design @ (xpxi @ design.T @ y)
+
+    df_resid = len(x) - 2
+    resid = y - fitted
+    variance = resid @ resid / df_resid * np.einsum("ij,jk,ik->i", design, xpxi, design)
+    half_width = stats.t.ppf(0.5 + level / 2, df_resid) * np.sqrt(variance)
+    return fitted, fitted - half_width, fitted + half_width
+
+
+def trend_figure(df, outcome, crime_type, policy_date=POLICY_DATE, level=0.95):
+    """
+    Monthly mean of the outcome in Denver and in the control counties, with
+    a linear fit and its confidence band before and after the policy.
+
+    :param df: panel with date, treatment and the outcome, e.g. from
+        arrest_cube.panel_frame
+    :param outcome: outcome column
+    :param crime_type: crime grouping shown in the title
+    :param policy_date: first month of the treatment
+    :param level: confidence level of the bands
+    :return: the figure
+    """
+    means = df.groupby(["treatment", "date"], as_index=False)[outcome].mean()
+    post = means["date"] >= policy_date
+
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+    for treated, color, label in [(0, "blue", "Control"), (1, "red", "Treatment")]:
+        for segment in [~post, post]:
+            rows = means[segment & (means["treatment"] == treated)]
+            if len(rows) < 3:
+                continue
+            x = mdates.date2num(rows["date"])
+            fitted, lower, upper = linear_fit_band(x, rows[outcome], level)
+            ax.plot(rows["date"], fitted, color=color, label=label)
+            ax.fill_between(rows["date"], lower, upper, color=color, alpha=0.15)
+            label = None
+
+    ax.set_xlabel("Month", fontsize=16)
+    ax.set_ylabel("Avg. Arrest Rate (per 100,000 people)", fontsize=16)
+    ax.set_title(
+        f"Diff-in-Diff of {outcome} ({crime_type}) Pre- and Post June 2020",
+        fontsize=20,
+    )
+    ax.axvline(x=np.datetime64(policy_date), color="black", ls=":")
+    ax.grid(visible=True, which="major", color="#999999", linestyle="-", alpha=0.2)
+    ax.tick_params(labelsize=14)
+    ax.legend(loc="upper right", fontsize=16)
+    return fig
+
+
+def event_study_figure(event_study, outcome, crime_type, interval="clustered"):
+    """
+
+    :param event_study: estimates written by 20_regression.py
+    :param outcome: independent variable to plot
+    :param crime_type: crime grouping, e.g. "non-violent"
+    :param interval: interval of the estimates, e.g. "clustered"
+    :return: the figure
+    """
+    rows = event_study[
+        (event_study["independent variable"] == outcome)
+        & (event_study["crime_type"] == crime_type)
+        & (event_study["interval"] == interval)
+    ]
+    # The month before STAR is the baseline, its coefficient is 0 by
+    # construction
+    x = np.append(rows["relative month"].to_numpy(), -1)
+    y = np.append(rows["coef"].to_numpy(), 0.0)
+    lower = np.append(rows["0.025"].to_numpy(), 0.0)
+    upper = np.append(rows["0.975"].to_numpy(), 0.0)
+    errors = np.vstack([y - lower, upper - y])
+
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+    pre = x < 0
+    for mask, color, label in [
+        (pre, "blue", "Before STAR"),
+        (~pre, "red", "After STAR"),
+    ]:
+        ax.errorbar(
+            x[mask],
+            y[mask],
+            yerr=errors[:, mask],
+            fmt="o",
+            color=color,
+            capsize=4,
+            label=label,
+        )
+
+    ax.set_xlabel("Months since June 2020", fontsize=16)
+    ax.set_ylabel("Denver vs. Control Arrest Rate (95% CI)", fontsize=16)
+    ax.set_title(f"Event Study of {outcome} ({crime_type})", fontsize=20)
+    ax.axhline(y=0, color="black", lw=1)
+    ax.axvline(x=-0.5, color="black", ls=":")
+    ax.grid(visible=True, which="major", color="#999999", linestyle="-", alpha=0.2)
+    ax.tick_params(labelsize=14)
+    ax.legend(loc="upper right", fontsize=16)
+    return fig
+
+
+_RENDER_DATA = {}
+
+
+def _init_render_worker(panels, event_study):
+    _RENDER_DATA.update(panels=panels, event_study=event_study)
+
+
+def _render_cell(panels, event_study, cell):
+    crime_type, outcome, directory, formats = cell
+    figures = {
+        "trends": trend_figure(panels[crime_type], outcome, crime_type),
+        "event_study": event_study_figure(event_study, outcome, crime_type),
+    }
+    paths = []
+    for kind, fig in figures.items():
+        for file_format in formats:
+            path = os.path.join(
+                directory, f"{kind}_{crime_type}_{outcome}.{file_format}"
+            )
+            fig.savefig(path)
+            paths.append(path)
+    return paths
+
+
+def _render_worker_cell(cell):
+    return _render_cell(_RENDER_DATA["panels"], _RENDER_DATA["event_study"], cell)
+
+
+@instrumented()
+def render_figures(
+    panels, event_study, outcomes, directory, formats=("png",), max_workers=None
+):
+    """
+    Write the trend and event study figures of every crime grouping and
+    outcome on a process pool. The figures are drawn on Agg canvases
+    without pyplot, so this runs unattended and never opens a window.
+
+    :param panels: {crime type: panel}, see trend_figure
+    :param event_study: estimates written by 20_regression.py
+    :param outcomes: outcome columns
+    :param directory: output directory, created if needed
+    :param formats: file formats, e.g. ("png", "svg")
+    :param max_workers: number of processes, 1 renders in this process
+    :return: paths of the written files
+    """
+    os.makedirs(directory, exist_ok=True)
+    cells = [
+        (crime_type, outcome, directory, list(formats))
+        for crime_type in panels
+        for outcome in outcomes
+    ]
+    if max_workers == 1:
+        paths = [_render_cell(panels, event_study, cell) for cell in cells]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_render_worker,
+            initargs=(panels, event_study),
+        ) as executor:
+            paths = list(executor.map(_render_worker_cell, cells))
+    return [path for cell_paths in paths for path in cell_paths]
@@ -0,0 +1,359 @@
+import argparse
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+
+# Tracing is switched on by setting TRACE_ENV to the JSON lines file to
+# append to, or with configure. Child processes inherit the variables, so
+# the stages run by pipeline.py write to the same files.
+TRACE_ENV = "PIPELINE_TRACE"
+CHROME_TRACE_ENV = "PIPELINE_CHROME_TRACE"
+TRACE_MEMORY_ENV = "PIPELINE_TRACE_MEMORY"
+
+_STATE = {
+    "path": os.environ.get(TRACE_ENV) or None,
+    "chrome_path": os.environ.get(CHROME_TRACE_ENV) or None,
+    "trace_memory": os.environ.get(TRACE_MEMORY_ENV, "") not in ("", "0"),
+}
+_STATE["enabled"] = _STATE["path"] is not None or _STATE["chrome_path"] is not None
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+
+
+def configure(path=None, chrome_path=None, trace_memory=False, environ=True):
+    """
+    Switch tracing on or off in this process, and in the processes it
+    starts afterwards.
+
+    :param path: JSON lines file the stage records are appended to
+    :param chrome_path: Chrome trace file the stages are appended to, it
+        can be opened in chrome://tracing or Perfetto
+    :param trace_memory: record the peak of the Python allocations with
+        tracemalloc, which slows down pure Python code
+    :param environ: also set the environment variables
+    """
+    path = os.path.abspath(path) if path else None
+    chrome_path = os.path.abspath(chrome_path) if chrome_path else None
+    _STATE.update(
+        path=path,
+        chrome_path=chrome_path,
+        trace_memory=trace_memory,
+        enabled=path is not None or chrome_path is not None,
+    )
+    if environ:
+        for name, value in [
+            (TRACE_ENV, path),
+            (CHROME_TRACE_ENV, chrome_path),
+            (TRACE_MEMORY_ENV, "1" if trace_memory else None),
+        ]:
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def count_rows(value):
+    """
+
+    :param value: data frame, series or array, or a tuple or list of them
+    :return: number of rows, summed over a tuple or list, None for anything
+        else
+    """
+    if isinstance(value, (tuple, list)):
+        counts = [count_rows(item) for item in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    shape = getattr(value, "shape", None)
+    if shape:
+        return int(shape[0])
+    return None
+
+
+def _rss_peak():
+    # VmHWM is the peak resident set size since the last reset, in kB;
+    # ru_maxrss, the peak since the process started, where it is missing
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peaks():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+
+def _traced_peak():
+    return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+
+def _write(record):
+    line = json.dumps(record)
+    event = {
+        "name": record["stage"],
+        "cat": "stage",
+        "ph": "X",
+        "ts": record["start"] * 1e6,
+        "dur": record["wall_seconds"] * 1e6,
+        "pid": record["pid"],
+        "tid": record["thread"],
+        "args": {
+            key: value
+            for key, value in record.items()
+            if key not in ("stage", "start", "pid", "thread")
+        },
+    }
+    with _LOCK:
+        if _STATE["path"] is not None:
+            with open(_STATE["path"], "a") as f:
+                f.write(line + "\n")
+        if _STATE["chrome_path"] is not None:
+            # The JSON array format of Chrome traces may omit the closing
+            # bracket, so every process can append its events
+            with open(_STATE["chrome_path"], "a") as f:
+                opening = "[\n" if f.tell() == 0 else ""
+                f.write(opening + json.dumps(event) + ",\n")
+
+
+def stage(name, rows_in=None):
+    """
+    Record the wall time, CPU time, peak memory and row counts of the code
+    in a with block. The block gets the record, a dict on which it can set
+    "rows_out" (or "rows_in"), and "cpu_seconds" and "peak_rss_mb" when the
+    work runs in another process. Stages can be nested; the peaks of a stage
+    include the peaks of the stages inside it. When tracing is off this is
+    a plain nullcontext with an unused dict.
+
+    :param name: stage name
+    :param rows_in: number of input rows
+    :return: context manager yielding the record
+    """
+    if not _STATE["enabled"]:
+        return nullcontext({})
+    return _traced_stage(name, rows_in)
+
+
+@contextmanager
+def _traced_stage(name, rows_in):
+    if _STATE["trace_memory"] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+
+    # The peaks are reset for every stage, what the enclosing stage reached
+    # so far is kept on the stack
+    if stack:
+        stack[-1]["rss"] = max(stack[-1]["rss"], _rss_peak())
+        stack[-1]["traced"] = max(stack[-1]["traced"], _traced_peak())
+    _reset_peaks()
+    record = {
+        "stage": name,
+        "parent": stack[-1]["name"] if stack else None,
+        "depth": len(stack),
+        "pid": os.getpid(),
+        "thread": threading.get_ident(),
+        "start": time.time(),
+        "rows_in": rows_in,
+        "rows_out": None,
+    }
+    frame = {"name": name, "rss": 0, "traced": 0}
+    stack.append(frame)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except BaseException as error:
+        record["error"] = type(error).__name__
+        raise
+    finally:
+        record["wall_seconds"] = time.perf_counter() - wall
+        record.setdefault("cpu_seconds", time.process_time() - cpu)
+        stack.pop()
+        frame["rss"] = max(frame["rss"], _rss_peak())
+        frame["traced"] = max(frame["traced"], _traced_peak())
+        if stack:
+            stack[-1]["rss"] = max(stack[-1]["rss"], frame["rss"])
+            stack[-1]["traced"] = max(stack[-1]["traced"], frame["traced"])
+        _reset_peaks()
+        record.setdefault("peak_rss_mb", frame["rss"] / 1024)
+        record["peak_traced_mb"] = (
+            frame["traced"] / 2**20 if tracemalloc.is_tracing() else None
+        )
+        _write(record)
+
+
+def instrumented(name=None, rows_in=count_rows, rows_out=count_rows):
+    """
+    Decorator that runs every call of a function as a stage. When tracing
+    is off the function is called directly.
+
+    :param name: stage name, defaults to the module and name of the function
+    :param rows_in: counts the input rows in the first argument
+    :param rows_out: counts the output rows in the return value
+    :return: the decorator
+    """
+
+    def decorate(func):
+        module = func.__module__
+        if module == "__main__":
+            # A script run directly is named after its file
+            main = getattr(sys.modules["__main__"], "__file__", None) or module
+            module = os.path.splitext(os.path.basename(main))[0]
+        label = name or f"{module}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _STATE["enabled"]:
+                return func(*args, **kwargs)
+            with _traced_stage(label, rows_in(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = rows_out(result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def add_arguments(parser):
+    """
+
+    :param parser: argparse parser to add the tracing options to
+    """
+    parser.add_argument("--trace", metavar="PATH", help="JSON lines stage trace")
+    parser.add_argument("--chrome-trace", metavar="PATH", help="Chrome trace file")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="record peak Python allocations with tracemalloc",
+    )
+
+
+def configure_from_args(args):
+    """
+    Switch tracing on when one of the options of add_arguments is given,
+    otherwise keep what the environment variables say. The paths are made
+    absolute either way, since child processes may run elsewhere.
+
+    :param args: parsed arguments
+    """
+    if args.trace or args.chrome_trace:
+        configure(args.trace, args.chrome_trace, args.trace_memory)
+    elif _STATE["enabled"]:
+        configure(
+            _STATE["path"],
+            _STATE["chrome_path"],
+            args.trace_memory or _STATE["trace_memory"],
+        )
+
+
+def read_trace(path):
+    """
+
+    :param path: JSON lines file written by stage
+    :return: the records, in the order they were written
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    """
+    Totals per stage name, slowest first.
+
+    :param records: records from read_trace
+    :return: one dict per stage name
+    """
+    totals = {}
+    for record in records:
+        total = totals.setdefault(
+            record["stage"],
+            {
+                "stage": record["stage"],
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "peak_rss_mb": 0.0,
+                "peak_traced_mb": None,
+                "rows_in": None,
+                "rows_out": None,
+            },
+        )
+        total["calls"] += 1
+        total["wall_seconds"] += record["wall_seconds"]
+        total["cpu_seconds"] += record["cpu_seconds"]
+        total["peak_rss_mb"] = max(total["peak_rss_mb"], record["peak_rss_mb"])
+        if record["peak_traced_mb"] is not None:
+            total["peak_traced_mb"] = max(
+                total["peak_traced_mb"] or 0.0, record["peak_traced_mb"]
+            )
+        for key in ["rows_in", "rows_out"]:
+            if record[key] is not None:
+                total[key] = (total[key] or 0) + record[key]
+    return sorted(totals.values(), key=lambda total: -total["wall_seconds"])
+
+
+# Columns of the printed summary: (heading, format)
+SUMMARY_COLUMNS = {
+    "stage": ("stage", "<45"),
+    "calls": ("calls", ">6"),
+    "wall_seconds": ("wall s", ">9.2f"),
+    "cpu_seconds": ("cpu s", ">9.2f"),
+    "peak_rss_mb": ("rss MB", ">9.1f"),
+    "peak_traced_mb": ("traced MB", ">10.1f"),
+    "rows_in": ("rows in", ">12"),
+    "rows_out": ("rows out", ">12"),
+}
+
+
+def format_summary(totals):
+    """
+
+    :param totals: totals from summarize
+    :return: the totals as a text table
+    """
+    widths = {
+        key: spec.lstrip("<>").split(".")[0]
+        for key, (_, spec) in SUMMARY_COLUMNS.items()
+    }
+    lines = [
+        " ".join(
+            f"{heading:{spec[0]}{widths[key]}}"
+            for key, (heading, spec) in SUMMARY_COLUMNS.items()
+        )
+    ]
+    for total in totals:
+        lines.append(
+            " ".join(
+                f"{total[key]:{spec}}"
+                if total[key] is not None
+                else f"{'':{spec[0]}{widths[key]}}"
+                for key, (_, spec) in SUMMARY_COLUMNS.items()
+            )
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a stage trace")
+    parser.add_argument("trace", help="JSON lines file written by the stages")
+    args = parser.parse_args()
+
+    print(format_summary(summarize(read_trace(args.trace))))
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from instrument import instrumented
+
+
+# Columns and compact dtypes that are actually used from the NIBRS tables
+INCIDENT_COLS = {
+    "DATA_YEAR": "int16",
+    "AGENCY_ID": "int32",
+    "INCIDENT_ID": "int64",
+    "INCIDENT_DATE": "str",
+}
+OFFENSE_COLS = {"INCIDENT_ID": "int64", "OFFENSE_TYPE_ID": "int16"}
+
+# Offense categories that are considered violent crimes
+VIOLENT_CATEGORIES = [
+    "Burglary/Breaking & Entering",
+    "Assault Offenses",
+    "Arson",
+    "Robbery",
+    "Sex Offenses",
+    "Animal Cruelty",
+    "Homicide Offenses",
+    "Kidnapping/Abduction",
+    "Sex Offenses, Non-forcible",
+    "Human Trafficking",
+]
+
+
+@instrumented()
+def read_filtered_csv(paths, columns, key, keep, chunksize=1_000_000):
+    """
+    Stream csv files in chunks, reading only the given columns with the given
+    dtypes, and keep the rows whose key column is in keep.
+
+    :param paths: csv files to read, one after the other
+    :param columns: mapping of the columns to read to their dtypes
+    :param key: column to filter on
+    :param keep: values of key to keep
+    :param chunksize: number of rows read per chunk
+    :return: the filtered rows of all files
+    """
+    # Build the hash table of the keys once and reuse it for every chunk
+    keep = pd.Index(keep).unique()
+    chunks = []
+    for path in paths:
+        for chunk in pd.read_csv(
+            path, usecols=list(columns), dtype=columns, chunksize=chunksize
+        ):
+            chunks.append(chunk[keep.get_indexer(chunk[key]) != -1])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def offense_categories(offense_type, offense_type_ids):
+    """
+    Resolve the offense category of every offense through an array indexed
+    by OFFENSE_TYPE_ID instead of a merge.
+
+    :param offense_type: the NIBRS_OFFENSE_TYPE table
+    :param offense_type_ids: OFFENSE_TYPE_ID of every offense
+    :return: (category code of every offense, -1 for unknown types, sorted
+        category names)
+    """
+    category_codes, category_names = pd.factorize(
+        offense_type["OFFENSE_CATEGORY_NAME"], sort=True
+    )
+    type_to_category = np.full(offense_type["OFFENSE_TYPE_ID"].max() + 2, -1)
+    type_to_category[offense_type["OFFENSE_TYPE_ID"]] = category_codes
+    offense_type_ids = np.asarray(offense_type_ids)
+    offense_category = type_to_category[
+        np.clip(offense_type_ids, 0, len(type_to_category) - 1)
+    ]
+    return offense_category, category_names
+
+
+@instrumented(rows_out=lambda result: len(result[0]))
+def classify_incidents(
+    offense_incident, offense_category, n_incidents, violent_categories
+):
+    """
+    Aggregate the offenses of every incident in one pass over integer codes.
+
+    :param offense_incident: incident code of every offense
+    :param offense_category: category code of every offense, -1 when unknown
+    :param n_incidents: number of incidents
+    :param violent_categories: boolean array, True for violent category codes
+    :return: per-incident any violent flag, any non-violent flag and the
+        category code of the first offense (-1 for incidents without offenses)
+    """
+    # Unknown categories (code -1) hit the trailing False and count as
+    # non-violent
+    is_violent = np.append(violent_categories, False)[offense_category]
+    any_violent = (
+        np.bincount(offense_incident, weights=is_violent, minlength=n_incidents) > 0
+    )
+    any_non_violent = (
+        np.bincount(offense_incident, weights=~is_violent, minlength=n_incidents) > 0
+    )
+
+    # An incident is counted once, under the category of its first offense
+    first_offense = np.full(n_incidents, len(offense_incident))
+    np.minimum.at(first_offense, offense_incident, np.arange(len(offense_incident)))
+    first_category = np.append(offense_category, -1)[first_offense]
+    return any_violent, any_non_violent, first_category
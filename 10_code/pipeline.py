@@ -0,0 +1,415 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import instrument
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_FILE = os.path.join(ROOT, "20_intermediate_files", ".pipeline_state.json")
+CODE_DIR = "10_code"
+
+# Every stage runs `script` from `cwd`; paths are relative to the repository
+# root, and an output can be a directory of figures. A stage depends on the
+# stages that write one of its inputs. The modules of CODE_DIR a script
+# imports are found by local_imports and are not listed in its inputs.
+STAGES = [
+    {
+        "name": "preprocessing",
+        "script": "10_code/10_preprocessing.py",
+        "cwd": "10_code",
+        "inputs": [
+            "00_source_data/ucr_arrests_monthly_all_crimes_race_sex_1974_2020_dta.zip",
+            "00_source_data/Crime data/agencies.csv",
+        ],
+        "outputs": [
+            "20_intermediate_files/aggregated.csv",
+            "20_intermediate_files/aggregated_violent_arrest.csv",
+            "20_intermediate_files/crosswalk.parquet",
+            "20_intermediate_files/arrest_cube/counties.npy",
+            "20_intermediate_files/arrest_cube/months.npy",
+            "20_intermediate_files/arrest_cube/offenses.npy",
+            "20_intermediate_files/arrest_cube/demographics.npy",
+            "20_intermediate_files/arrest_cube/counts.npy",
+            "20_intermediate_files/arrest_cube/population.npy",
+            "20_intermediate_files/arrest_cube/reported.npy",
+        ],
+    },
+    {
+        "name": "crime_data_cleaning",
+        "script": "10_code/crime_data_cleaning.py",
+        "cwd": "10_code",
+        "inputs": [
+            "00_source_data/Crime data/NIBRS_OFFENSE_TYPE.csv",
+            "00_source_data/Crime data/2019_NIBRS_incident.csv",
+            "00_source_data/Crime data/2020_NIBRS_incident.csv",
+            "00_source_data/Crime data/2019_NIBRS_offense.csv",
+            "00_source_data/Crime data/2020_NIBRS_offense.csv",
+            "20_intermediate_files/crosswalk.parquet",
+            "20_intermediate_files/population.csv",
+        ],
+        "outputs": ["20_intermediate_files/crime_rate.csv"],
+    },
+    {
+        "name": "regression",
+        "script": "10_code/20_regression.py",
+        "cwd": ".",
+        "inputs": [
+            "00_source_data/program_adoptions.csv",
+            "20_intermediate_files/arrest_cube/counties.npy",
+            "20_intermediate_files/arrest_cube/months.npy",
+            "20_intermediate_files/arrest_cube/offenses.npy",
+            "20_intermediate_files/arrest_cube/demographics.npy",
+            "20_intermediate_files/arrest_cube/counts.npy",
+            "20_intermediate_files/arrest_cube/population.npy",
+            "20_intermediate_files/arrest_cube/reported.npy",
+        ],
+        "outputs": [
+            "20_intermediate_files/regression_results.csv",
+            "20_intermediate_files/placebo_test.csv",
+            "20_intermediate_files/regression_grid.csv",
+            "20_intermediate_files/wild_bootstrap.csv",
+            "20_intermediate_files/randomization_inference.csv",
+            "20_intermediate_files/randomization_p_values.csv",
+            "20_intermediate_files/event_study.csv",
+            "20_intermediate_files/synthetic_control_weights.csv",
+            "20_intermediate_files/synthetic_control_gaps.csv",
+            "20_intermediate_files/synthetic_control_p_values.csv",
+            "20_intermediate_files/staggered_att.csv",
+            "20_intermediate_files/staggered_overall.csv",
+            "20_intermediate_files/staggered_dynamic.csv",
+        ],
+    },
+    {
+        "name": "diff_in_diff_plots",
+        "script": "10_code/diff-in-diff_plots.py",
+        "cwd": ".",
+        "inputs": [
+            "20_intermediate_files/event_study.csv",
+            "20_intermediate_files/arrest_cube/counties.npy",
+            "20_intermediate_files/arrest_cube/months.npy",
+            "20_intermediate_files/arrest_cube/offenses.npy",
+            "20_intermediate_files/arrest_cube/demographics.npy",
+            "20_intermediate_files/arrest_cube/counts.npy",
+            "20_intermediate_files/arrest_cube/population.npy",
+            "20_intermediate_files/arrest_cube/reported.npy",
+        ],
+        "outputs": ["30_results/Plots/diff_in_diff"],
+    },
+    {
+        "name": "arrests_eda",
+        "script": "10_code/EDA/arrests_eda.py",
+        "cwd": "10_code",
+        "inputs": [
+            "20_intermediate_files/arrest_cube/counties.npy",
+            "20_intermediate_files/arrest_cube/months.npy",
+            "20_intermediate_files/arrest_cube/offenses.npy",
+            "20_intermediate_files/arrest_cube/demographics.npy",
+            "20_intermediate_files/arrest_cube/counts.npy",
+            "20_intermediate_files/arrest_cube/population.npy",
+            "20_intermediate_files/arrest_cube/reported.npy",
+        ],
+        "outputs": [
+            "30_results/Plots/county trends",
+            "30_results/Plots/charts/arrest_trends.html",
+            "30_results/Plots/charts/data/arrest_trends.json",
+        ],
+    },
+    {
+        "name": "crime_rate_plots",
+        "script": "10_code/EDA/crime_rate_plots.py",
+        "cwd": "10_code",
+        "inputs": [
+            "20_intermediate_files/crime_rate.csv",
+        ],
+        "outputs": [
+            "30_results/Plots/charts/crime_trends.html",
+            "30_results/Plots/charts/data/crime_trends.json",
+        ],
+    },
+]
+
+
+def file_hash(path, known):
+    """
+    SHA-256 of a file. Digests in known are reused as long as the size and
+    mtime of the file did not change, so large inputs are only read once.
+
+    :param path: path relative to ROOT
+    :param known: {path: {"size", "mtime", "sha256"}} from the last run,
+        updated in place
+    :return: hex digest
+    """
+    stat = os.stat(os.path.join(ROOT, path))
+    entry = known.get(path)
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(os.path.join(ROOT, path), "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    known[path] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
+    return digest.hexdigest()
+
+
+def output_hash(path, known):
+    """
+    file_hash of a file, or for a directory a hash over the names and
+    digests of every file in it, so adding, deleting or editing any of them
+    changes it.
+
+    :param path: path relative to ROOT
+    :param known: file digests, see file_hash
+    :return: hex digest
+    """
+    if not os.path.isdir(os.path.join(ROOT, path)):
+        return file_hash(path, known)
+    digest = hashlib.sha256()
+    for directory, _, files in sorted(os.walk(os.path.join(ROOT, path))):
+        for name in sorted(files):
+            file_path = os.path.relpath(os.path.join(directory, name), ROOT)
+            digest.update(file_path.encode())
+            digest.update(file_hash(file_path, known).encode())
+    return digest.hexdigest()
+
+
+def local_imports(script):
+    """
+    Modules of CODE_DIR that a script imports, directly or through another
+    of them, found by parsing their import statements. Imports inside
+    functions count as well.
+
+    :param script: path relative to ROOT
+    :return: sorted paths relative to ROOT of the imported modules
+    """
+    found = set()
+    pending = [script]
+    while pending:
+        with open(os.path.join(ROOT, pending.pop())) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = f"{CODE_DIR}/{name.split('.')[0]}.py"
+                if path not in found and os.path.exists(os.path.join(ROOT, path)):
+                    found.add(path)
+                    pending.append(path)
+    return sorted(found - {script})
+
+
+def stage_key(stage, known):
+    """
+
+    :param stage: stage from STAGES
+    :param known: file digests, see file_hash
+    :return: hash over the contents of the stage's script, the modules it
+        imports and its inputs
+    """
+    digest = hashlib.sha256()
+    for path in [stage["script"]] + local_imports(stage["script"]) + stage["inputs"]:
+        digest.update(path.encode())
+        digest.update(file_hash(path, known).encode())
+    return digest.hexdigest()
+
+
+def is_fresh(stage, key, state):
+    """
+    A stage can be skipped when it last ran on the same inputs and its
+    outputs are still the ones it wrote.
+
+    :param stage: stage from STAGES
+    :param key: stage_key of the stage
+    :param state: pipeline state from the last run
+    :return: True if the stage does not need to run
+    """
+    last = state["stages"].get(stage["name"])
+    if last is None or last["key"] != key:
+        return False
+    for path in stage["outputs"]:
+        if not os.path.exists(os.path.join(ROOT, path)):
+            return False
+        if output_hash(path, state["files"]) != last["outputs"].get(path):
+            return False
+    return True
+
+
+def dependencies(stages):
+    """
+
+    :param stages: stages to run
+    :return: {stage name: names of the stages writing one of its inputs}
+    """
+    writers = {path: stage["name"] for stage in stages for path in stage["outputs"]}
+    return {
+        stage["name"]: {writers[path] for path in stage["inputs"] if path in writers}
+        for stage in stages
+    }
+
+
+def run_stage(stage):
+    """
+    Run the script of a stage in a subprocess. Its record in the trace has
+    the CPU time and peak RSS of the subprocess, taken from its resource
+    usage when it is reaped, not those of the pipeline process.
+
+    :param stage: stage from STAGES
+    :return: the finished subprocess
+    """
+    # The stage inherits the tracing variables and appends its own records.
+    # 10_code is on the path, so that the scripts in subdirectories such as
+    # EDA import the shared modules like the scripts next to them
+    path = [os.path.join(ROOT, "10_code"), os.environ.get("PYTHONPATH")]
+    env = dict(
+        os.environ,
+        MPLBACKEND="Agg",
+        PYTHONPATH=os.pathsep.join(entry for entry in path if entry),
+    )
+    args = [sys.executable, os.path.join(ROOT, stage["script"])]
+    with instrument.stage("pipeline." + stage["name"]) as record:
+        # The output goes to files rather than pipes, so the process can be
+        # reaped with wait4 without draining them first
+        with tempfile.TemporaryFile("w+") as out, tempfile.TemporaryFile("w+") as err:
+            process = subprocess.Popen(
+                args,
+                cwd=os.path.join(ROOT, stage["cwd"]),
+                env=env,
+                stdout=out,
+                stderr=err,
+            )
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            out.seek(0)
+            err.seek(0)
+            stdout, stderr = out.read(), err.read()
+        # ru_maxrss is in kilobytes on Linux
+        record["cpu_seconds"] = usage.ru_utime + usage.ru_stime
+        record["peak_rss_mb"] = usage.ru_maxrss / 1024
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    return {"files": {}, "stages": {}}
+
+
+def save_state(state):
+    with open(STATE_FILE, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def run(names=None, force=False, jobs=None, dry_run=False):
+    """
+    Run the stages in dependency order, skipping the ones whose script and
+    inputs are unchanged, and running independent stages concurrently.
+
+    :param names: stages to run, None runs every stage
+    :param force: run the stages even if they are fresh
+    :param jobs: number of stages running at the same time
+    :param dry_run: only report which stages would run
+    :return: {stage name: "ran", "skipped" or "failed"}
+    """
+    stages = [stage for stage in STAGES if names is None or stage["name"] in names]
+    deps = dependencies(stages)
+    state = load_state()
+    status = {}
+    running = {}
+    would_run = set()
+
+    with ThreadPoolExecutor(max_workers=jobs or len(stages)) as executor:
+        while len(status) < len(stages):
+            for stage in stages:
+                name = stage["name"]
+                if name in status or name in [n for n, _ in running.values()]:
+                    continue
+                if any(status.get(dep) == "failed" for dep in deps[name]):
+                    status[name] = "failed"
+                    print(f"{name}: not run, an upstream stage failed")
+                    continue
+                if any(dep not in status for dep in deps[name]):
+                    continue
+
+                try:
+                    key = stage_key(stage, state["files"])
+                except FileNotFoundError as error:
+                    status[name] = "failed"
+                    print(f"{name}: missing input {error.filename}")
+                    continue
+                # In a dry run the outputs of a stage that would run are not
+                # rewritten, so its downstream stages would run as well
+                upstream = any(dep in would_run for dep in deps[name])
+                if not force and not upstream and is_fresh(stage, key, state):
+                    status[name] = "skipped"
+                    print(f"{name}: up to date")
+                elif dry_run:
+                    status[name] = "ran"
+                    would_run.add(name)
+                    print(f"{name}: would run")
+                else:
+                    print(f"{name}: running")
+                    running[executor.submit(run_stage, stage)] = (name, key)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key = running.pop(future)
+                stage = next(stage for stage in stages if stage["name"] == name)
+                result = future.result()
+                if result.returncode != 0:
+                    status[name] = "failed"
+                    print(f"{name}: failed\n{result.stderr}")
+                    continue
+                status[name] = "ran"
+                state["stages"][name] = {
+                    "key": key,
+                    "outputs": {
+                        path: output_hash(path, state["files"])
+                        for path in stage["outputs"]
+                    },
+                }
+                save_state(state)
+                print(f"{name}: done")
+
+    if not dry_run:
+        save_state(state)
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline stages whose inputs changed."
+    )
+    parser.add_argument("stages", nargs="*", help="stages to run, all by default")
+    parser.add_argument("--force", action="store_true", help="rerun fresh stages")
+    parser.add_argument("--jobs", type=int, help="stages running at the same time")
+    parser.add_argument("--dry-run", action="store_true", help="only show the plan")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure_from_args(args)
+
+    unknown = set(args.stages) - {stage["name"] for stage in STAGES}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    result = run(args.stages or None, args.force, args.jobs, args.dry_run)
+    sys.exit(1 if "failed" in result.values() else 0)
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+
+MONTHS = [
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+]
+MONTH_ABBREVIATIONS = [name[:3].upper() for name in MONTHS]
+
+# Months are ordered categoricals: one byte per row, and sorting or grouping
+# by them follows the calendar
+MONTH_DTYPE = pd.CategoricalDtype(MONTHS, ordered=True)
+MONTH_ABBREVIATION_DTYPE = pd.CategoricalDtype(MONTH_ABBREVIATIONS, ordered=True)
+
+# Label columns with few distinct values, stored as categoricals
+ARREST_CATEGORIES = [
+    "ori",
+    "agency_name",
+    "state_abb",
+    "fips_state_county_code",
+    "fips_place_code",
+]
+CRIME_CATEGORIES = ["fips", "ORI", "COUNTY_NAME", "OFFENSE_CATEGORY_NAME"]
+
+
+def month_categories(month, abbreviated=False):
+    """
+    Turn month names in any case, full ("january") or abbreviated ("JAN"),
+    into an ordered categorical. Every distinct name is looked up once.
+
+    :param month: series of month names
+    :param abbreviated: use MONTH_ABBREVIATION_DTYPE instead of MONTH_DTYPE
+    :return: categorical series, NaN for unknown names
+    """
+    dtype = MONTH_ABBREVIATION_DTYPE if abbreviated else MONTH_DTYPE
+    if month.dtype == dtype:
+        return month
+
+    month = month.astype("category")
+    lookup = {name[:3]: i for i, name in enumerate(MONTHS)}
+    numbers = [lookup.get(str(name)[:3].lower(), -1) for name in month.cat.categories]
+    codes = np.append(np.array(numbers, dtype=np.int8), -1)[month.cat.codes]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, dtype=dtype),
+        index=month.index,
+        name=month.name,
+    )
+
+
+def categorize(df, columns):
+    """
+
+    :param df: data frame, converted in place
+    :param columns: columns to store as categoricals, missing ones are skipped
+    :return: df
+    """
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def downcast_counts(df, columns):
+    """
+    Store integer counts in the smallest integer type that holds them. Float
+    columns without missing values and fractions are converted as well.
+
+    :param df: data frame, converted in place
+    :param columns: count columns, missing ones are skipped
+    :return: df
+    """
+    for col in columns:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col].dtype):
+            if not pd.api.types.is_bool_dtype(df[col].dtype):
+                df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+
+def arrest_schema(df):
+    """
+    Compact dtypes of the UCR arrest data: categorical labels, a month
+    categorical, a 16 bit year and downcast counts.
+
+    :param df: arrest data, converted in place
+    :return: df
+    """
+    categorize(df, ARREST_CATEGORIES)
+    if "month" in df.columns:
+        df["month"] = month_categories(df["month"])
+    if "year" in df.columns:
+        df["year"] = df["year"].astype(np.int16)
+    keys = set(ARREST_CATEGORIES) | {"month", "year"}
+    return downcast_counts(df, [col for col in df.columns if col not in keys])
+
+
+def crime_schema(df):
+    """
+    Compact dtypes of the NIBRS crime counts: categorical labels, an
+    abbreviated month categorical, a 16 bit year and downcast counts.
+
+    :param df: crime data, converted in place
+    :return: df
+    """
+    categorize(df, CRIME_CATEGORIES)
+    if "month" in df.columns:
+        df["month"] = month_categories(df["month"], abbreviated=True)
+    if "DATA_YEAR" in df.columns:
+        df["DATA_YEAR"] = df["DATA_YEAR"].astype(np.int16)
+    return downcast_counts(df, ["crime_count", "violent_crime", "population"])
+
+
+def align_categories(dfs, columns=None):
+    """
+    Give the same categorical dtype to a column in every data frame, so that
+    concatenating or merging them keeps it categorical instead of falling
+    back to object.
+
+    :param dfs: data frames
+    :param columns: columns to align, defaults to every categorical column
+    :return: the data frames, in the same order
+    """
+    dfs = list(dfs)
+    if columns is None:
+        columns = dict.fromkeys(
+            col
+            for df in dfs
+            for col, dtype in df.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype)
+        )
+
+    for col in columns:
+        series = [df[col] for df in dfs if col in df.columns]
+        dtypes = {s.dtype for s in series}
+        if len(dtypes) == 1 and isinstance(series[0].dtype, pd.CategoricalDtype):
+            continue
+        categories = [
+            s.cat.categories
+            if isinstance(s.dtype, pd.CategoricalDtype)
+            else pd.Index(s.dropna().unique())
+            for s in series
+        ]
+        dtype = pd.CategoricalDtype(categories[0].append(categories[1:]).unique())
+        dfs = [
+            df.assign(**{col: df[col].astype(dtype)}) if col in df.columns else df
+            for df in dfs
+        ]
+    return dfs
+
+
+def concat(dfs, **kwargs):
+    """
+    pd.concat that keeps categorical columns categorical.
+
+    :param dfs: data frames
+    :param kwargs: passed to pd.concat
+    :return: the concatenated data frame
+    """
+    return pd.concat(align_categories(dfs), **kwargs)
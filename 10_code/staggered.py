@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+from instrument import instrumented
+from synthetic_control import panel_array
+
+
+def read_adoptions(path):
+    """
+
+    :param path: CSV with fips_state_county_code and adoption_month (YYYY-MM)
+    :return: {FIPS code: first month of the program}
+    """
+    adoptions = pd.read_csv(path, dtype={"fips_state_county_code": str})
+    months = pd.to_datetime(adoptions["adoption_month"], format="%Y-%m")
+    return dict(zip(adoptions["fips_state_county_code"], months))
+
+
+def cohort_sums(values, cohort, n_cohorts):
+    """
+
+    :param values: entities x times x outcomes array
+    :param cohort: cohort code of every entity
+    :param n_cohorts: number of cohorts
+    :return: (cohorts x times x outcomes sums, entities per cohort)
+    """
+    sums = np.zeros((n_cohorts,) + values.shape[1:])
+    np.add.at(sums, cohort, values)
+    return sums, np.bincount(cohort, minlength=n_cohorts)
+
+
+@instrumented()
+def group_time_att(
+    df,
+    outcomes,
+    adoptions,
+    control="never_treated",
+    entity="fips_state_county_code",
+    time="date",
+):
+    """
+    Group-time average treatment effects (Callaway and Sant'Anna) of every
+    outcome without covariates. A cohort is the set of entities adopting in
+    the same period, and ATT(g, t) compares the change of the cohort's mean
+    outcome between g - 1 and t with the same change of the control
+    entities.
+
+    The panel is reduced once to cohort sums, and the control means of
+    every cell are suffix sums over the cohorts ordered by adoption, so all
+    cells come out of a few array operations instead of one regression per
+    cell.
+
+    :param df: balanced long panel with one row per entity and time
+    :param outcomes: outcome columns
+    :param adoptions: {entity: adoption time}, the other entities are never
+        treated
+    :param control: "never_treated" or "not_yet_treated" (entities that have
+        not adopted by t or g - 1)
+    :param entity: entity column
+    :param time: time column
+    :return: one row per cohort, time and outcome with the ATT, the event
+        time t - g and the number of treated and control entities
+    """
+    values, entities, times = panel_array(df, outcomes, entity, time)
+    if np.isnan(values).any():
+        raise ValueError("group_time_att needs a balanced panel")
+
+    # Adoption period of every entity, len(times) for the never treated
+    adopted = pd.Series(adoptions, dtype="datetime64[ns]").reindex(entities)
+    first = np.searchsorted(times, adopted.to_numpy(dtype=times.dtype))
+    first[adopted.isna().to_numpy()] = len(times)
+    if np.any(first == 0):
+        raise ValueError("entities treated in the first period have no baseline")
+
+    # Cohorts ordered by adoption period, the never treated come last
+    periods, cohort = np.unique(first, return_inverse=True)
+    if periods[-1] != len(times):
+        periods = np.append(periods, len(times))
+    sums, sizes = cohort_sums(values, cohort, len(periods))
+    suffix_sums = np.cumsum(sums[::-1], axis=0)[::-1]
+    suffix_sizes = np.cumsum(sizes[::-1])[::-1]
+
+    treated = np.flatnonzero(periods < len(times))
+    g = periods[treated][:, None]
+    t = np.arange(len(times))[None, :]
+    base = g - 1
+    if control == "never_treated":
+        first_control = np.full(np.broadcast(g, t).shape, len(periods) - 1)
+    elif control == "not_yet_treated":
+        latest = np.maximum(t, base)
+        first_control = np.searchsorted(periods, latest, side="right")
+        # The cohort itself is never its own control
+        first_control = np.maximum(first_control, treated[:, None] + 1)
+    else:
+        raise ValueError(f"Unknown control {control!r}")
+
+    # Control sums at t and at the base period of every cell, with an empty
+    # control group past the last cohort
+    padded_sums = np.concatenate([suffix_sums, np.zeros((1,) + sums.shape[1:])])
+    padded_sizes = np.append(suffix_sizes, 0)
+    n_control = padded_sizes[first_control]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        control_change = (
+            padded_sums[first_control, t] - padded_sums[first_control, base]
+        ) / n_control[..., None]
+
+    cohort_means = sums[treated] / sizes[treated][:, None, None]
+    cohort_change = cohort_means - cohort_means[np.arange(len(treated))[:, None], base]
+    att = cohort_change - control_change
+
+    valid = (t != base) & (n_control > 0)
+    cell, period = np.nonzero(valid)
+    return pd.DataFrame(
+        {
+            "cohort": np.repeat(times[periods[treated][cell]], len(outcomes)),
+            time: np.repeat(times[period], len(outcomes)),
+            "event time": np.repeat(period - periods[treated][cell], len(outcomes)),
+            "independent variable": np.tile(list(outcomes), len(cell)),
+            "att": att[cell, period].ravel(),
+            "treated": np.repeat(sizes[treated][cell], len(outcomes)),
+            "controls": np.repeat(n_control[cell, period], len(outcomes)),
+        }
+    )
+
+
+def aggregate_att(cells):
+    """
+    Aggregate group-time effects, weighting every cohort by its size.
+
+    :param cells: group-time effects from group_time_att
+    :return: (overall effect of every outcome averaged over the post
+        treatment cells, dynamic effect of every outcome and event time)
+    """
+    weighted = cells.assign(weighted=cells["att"] * cells["treated"])
+
+    post = weighted[weighted["event time"] >= 0].groupby(
+        "independent variable", sort=False
+    )
+    overall = (post["weighted"].sum() / post["treated"].sum()).rename("att")
+
+    by_event = weighted.groupby(["independent variable", "event time"], sort=False)
+    dynamic = (by_event["weighted"].sum() / by_event["treated"].sum()).rename("att")
+    # Outcomes in their original order, event times ascending
+    order = {name: i for i, name in enumerate(overall.index)}
+    dynamic = dynamic.reset_index().sort_values(
+        ["independent variable", "event time"],
+        key=lambda col: col.map(order) if col.name == "independent variable" else col,
+    )
+    return overall.reset_index(), dynamic.reset_index(drop=True)
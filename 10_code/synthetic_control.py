@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from instrument import instrumented
+
+
+def panel_array(df, outcomes, entity="fips_state_county_code", time="date"):
+    """
+
+    :param df: long panel with one row per entity and time
+    :param outcomes: outcome columns
+    :param entity: entity column
+    :param time: time column
+    :return: (entities x times x outcomes array, entities, times in order)
+    """
+    entities, entity_codes = np.unique(df[entity].to_numpy(), return_inverse=True)
+    times, time_codes = np.unique(df[time].to_numpy(), return_inverse=True)
+    values = np.full((len(entities), len(times), len(outcomes)), np.nan)
+    values[entity_codes, time_codes] = df[list(outcomes)].to_numpy(dtype=float)
+    return values, entities, times
+
+
+def affine_minimum(points, valid, ridge=1e-12):
+    """
+    Point of minimum norm of the affine hull of every support, solving the
+    padded KKT systems of all problems in one call.
+
+    :param points: ... x K x T support points, padded to K slots
+    :param valid: boolean ... x K mask of the slots in use
+    :param ridge: relative ridge keeping degenerate supports solvable
+    :return: ... x K affine weights, 0 in the unused slots
+    """
+    size = valid.shape[-1]
+    both = valid[..., :, None] & valid[..., None, :]
+    gram = np.where(both, points @ np.swapaxes(points, -1, -2), 0)
+    scale = np.trace(gram, axis1=-2, axis2=-1) / valid.sum(axis=-1)
+    diagonal = np.where(valid, ridge * scale[..., None], 1)
+
+    kkt = np.zeros(valid.shape[:-1] + (size + 1, size + 1))
+    kkt[..., :size, :size] = gram + diagonal[..., None] * np.eye(size)
+    kkt[..., :size, size] = valid
+    kkt[..., size, :size] = valid
+    rhs = np.zeros(valid.shape[:-1] + (size + 1, 1))
+    rhs[..., size, 0] = 1
+    return np.linalg.solve(kkt, rhs)[..., :size, 0]
+
+
+def simplex_least_squares(donors, target, mask=None, tol=1e-10, max_iter=None):
+    """
+    Non negative donor weights that sum to 1 and minimize
+    ||target - donors @ w||^2, for a batch of problems at once.
+
+    This is Wolfe's minimum norm point algorithm on the points
+    donors[:, j] - target: the solution has at most T + 1 donors, and the
+    active set is grown one donor at a time, so it converges in a few times
+    T steps however large the pool is. All problems step in lockstep, their
+    supports padded to T + 2 slots; a step costs one batched T x J product
+    and one batched solve of the small KKT systems.
+
+    :param donors: m x T x J donor outcomes, one matrix per outcome
+    :param target: m x T x b target outcomes, b targets per outcome
+    :param mask: boolean b x J array of the donors each target may use
+    :param tol: relative optimality gap that counts as converged
+    :param max_iter: maximum number of steps, defaults to 50 (T + 2)
+    :return: m x b x J weights
+    """
+    n_outcomes, n_times, n_donors = donors.shape
+    n_targets = target.shape[2]
+    size = n_times + 2
+    if mask is None:
+        mask = np.ones((n_targets, n_donors), dtype=bool)
+    mask = np.broadcast_to(mask, (n_outcomes, n_targets, n_donors))
+    if max_iter is None:
+        max_iter = 50 * size
+
+    # Contiguous copies keep the batched products on BLAS
+    donors = np.ascontiguousarray(donors)
+    y = np.ascontiguousarray(target.transpose(0, 2, 1))
+    outcome = np.arange(n_outcomes)[:, None, None]
+    problem = np.indices((n_outcomes, n_targets))
+
+    # Start from the closest donor
+    distance = (donors**2).sum(axis=1)[:, None, :] - 2 * y @ donors
+    support = np.zeros((n_outcomes, n_targets, size), dtype=np.int64)
+    excluded = np.where(mask, 0, np.inf)
+    support[..., 0] = (distance + excluded).argmin(axis=-1)
+    valid = np.zeros(support.shape, dtype=bool)
+    valid[..., 0] = True
+    weights = valid.astype(float)
+    done = np.zeros((n_outcomes, n_targets), dtype=bool)
+
+    for _ in range(max_iter):
+        points = donors[outcome, :, support] - y[:, :, None, :]
+        affine = affine_minimum(points, valid)
+        corral = np.all((affine > 0) | ~valid, axis=-1) & ~done
+
+        # Minor step: move towards the affine minimum until a weight hits 0
+        # and drop that donor
+        minor = ~corral & ~done
+        shrink = valid & (affine <= 0)
+        ratio = np.where(shrink, weights / np.where(shrink, weights - affine, 1), 1)
+        theta = np.where(minor, ratio.min(axis=-1), 1)[..., None]
+        weights = np.where(
+            (minor | corral)[..., None], weights + theta * (affine - weights), weights
+        )
+        dropped = minor[..., None] & valid & (weights <= 1e-14)
+        valid &= ~dropped
+        weights = np.where(valid, weights, 0)
+
+        # Major step: add the donor that most decreases the objective, or
+        # stop when the optimality gap is small
+        x = (weights[..., None] * points).sum(axis=-2)
+        x_norm = (x**2).sum(axis=-1)
+        gradient = x @ donors - (x * y).sum(axis=-1, keepdims=True)
+        best = (gradient + excluded).argmin(axis=-1)
+        gap = x_norm - gradient[problem[0], problem[1], best]
+        free = np.argmin(valid, axis=-1)
+        stuck = np.any(valid & (support == best[..., None]), axis=-1) | valid.all(-1)
+        done |= corral & ((gap <= tol * x_norm) | stuck)
+
+        grow = corral & ~done
+        support[problem[0], problem[1], free] = np.where(
+            grow, best, support[problem[0], problem[1], free]
+        )
+        valid[problem[0], problem[1], free] |= grow
+        if done.all():
+            break
+
+    result = np.zeros((n_outcomes, n_targets, n_donors))
+    np.add.at(
+        result,
+        (problem[0][..., None], problem[1][..., None], support),
+        np.where(valid, weights, 0),
+    )
+    return result
+
+
+def synthetic_control(values, treated, pre, donors=None):
+    """
+    Synthetic control of one entity for every outcome: each outcome gets its
+    own donor weights, fitted on the pre-period.
+
+    :param values: entities x times x outcomes array from panel_array
+    :param treated: position of the treated entity
+    :param pre: boolean mask of the pre-period times
+    :param donors: positions of the donor entities, defaults to every other
+        entity
+    :return: (donors x outcomes weights, times x outcomes gaps between the
+        treated entity and its synthetic control)
+    """
+    if donors is None:
+        donors = np.delete(np.arange(values.shape[0]), treated)
+    pool = values[donors].transpose(2, 1, 0)
+    target = values[treated].T[:, :, None]
+    weights = simplex_least_squares(pool[:, pre], target[:, pre])[:, 0]
+    gaps = values[treated] - np.einsum("mtj,mj->tm", pool, weights)
+    return weights.T, gaps
+
+
+_PLACEBO_PANEL = {}
+
+
+def _init_placebo_worker(values, pre):
+    _PLACEBO_PANEL.update(values=values, pre=pre)
+
+
+def _placebo_batch(values, pre, donors, batch):
+    # Every target is one of the donors, which is masked out of its own pool
+    pool = values[donors].transpose(2, 1, 0)
+    target = values[donors[batch]].transpose(2, 1, 0)
+    mask = donors[None, :] != donors[batch][:, None]
+    weights = simplex_least_squares(pool[:, pre], target[:, pre], mask)
+    return target - np.einsum("mtj,mbj->mtb", pool, weights)
+
+
+def _placebo_worker(args):
+    donors, batch = args
+    return _placebo_batch(
+        _PLACEBO_PANEL["values"], _PLACEBO_PANEL["pre"], donors, batch
+    )
+
+
+def placebo_gaps(values, pre, donors, batch_size=64, max_workers=None):
+    """
+    In-space placebos: every donor is treated in turn and fitted from the
+    rest of the pool. Batches of placebos are solved together and the
+    batches run on a process pool.
+
+    :param values: entities x times x outcomes array from panel_array
+    :param pre: boolean mask of the pre-period times
+    :param donors: positions of the donor entities
+    :param batch_size: number of placebos solved together
+    :param max_workers: number of processes, 1 runs in this process
+    :return: donors x times x outcomes gaps, in the order of donors
+    """
+    donors = np.asarray(donors)
+    batches = [
+        (donors, np.arange(start, min(start + batch_size, len(donors))))
+        for start in range(0, len(donors), batch_size)
+    ]
+    if max_workers == 1:
+        gaps = [_placebo_batch(values, pre, *batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_placebo_worker,
+            initargs=(values, pre),
+        ) as executor:
+            gaps = list(executor.map(_placebo_worker, batches))
+    return np.concatenate(gaps, axis=2).transpose(2, 1, 0)
+
+
+def rmspe_ratio(gaps, pre):
+    """
+
+    :param gaps: ... x times x outcomes gaps
+    :param pre: boolean mask of the pre-period times
+    :return: ratio of the post- to the pre-period root mean squared gap
+    """
+    pre_rmspe = np.sqrt(np.mean(gaps[..., pre, :] ** 2, axis=-2))
+    post_rmspe = np.sqrt(np.mean(gaps[..., ~pre, :] ** 2, axis=-2))
+    return post_rmspe / pre_rmspe
+
+
+@instrumented()
+def synthetic_control_study(
+    df,
+    outcomes,
+    treated,
+    policy_date,
+    donors=None,
+    entity="fips_state_county_code",
+    time="date",
+    max_workers=None,
+):
+    """
+    Synthetic control of the treated entity for every outcome, with in-space
+    placebos for every donor. The p-value of an outcome is the share of
+    units, the treated one included, whose post/pre RMSPE ratio is at least
+    as large as the treated entity's.
+
+    :param df: long panel with one row per entity and time
+    :param outcomes: outcome columns
+    :param treated: treated entity
+    :param policy_date: first treated time
+    :param donors: donor entities, defaults to every other entity
+    :param entity: entity column
+    :param time: time column
+    :param max_workers: number of processes running the placebos
+    :return: (weights frame, gaps frame, p-value frame)
+    """
+    values, entities, times = panel_array(df, outcomes, entity, time)
+    pre = times < np.asarray(policy_date, dtype=times.dtype)
+    position = {name: i for i, name in enumerate(entities)}
+    if donors is None:
+        donors = [name for name in entities if name != treated]
+    donor_positions = np.array([position[name] for name in donors])
+
+    weights, gaps = synthetic_control(values, position[treated], pre, donor_positions)
+    placebo = placebo_gaps(values, pre, donor_positions, max_workers=max_workers)
+
+    ratio = rmspe_ratio(gaps, pre)
+    placebo_ratio = rmspe_ratio(placebo, pre)
+    p_values = (1 + (placebo_ratio >= ratio * (1 - 1e-9)).sum(axis=0)) / (
+        1 + len(donors)
+    )
+
+    all_gaps = np.concatenate([gaps[None], placebo])
+    gap_frame = pd.DataFrame(
+        {
+            entity: np.repeat([treated] + list(donors), len(times) * len(outcomes)),
+            "placebo": np.repeat(
+                [False] + [True] * len(donors), len(times) * len(outcomes)
+            ),
+            time: np.tile(np.repeat(times, len(outcomes)), len(donors) + 1),
+            "independent variable": np.tile(outcomes, (len(donors) + 1) * len(times)),
+            "gap": all_gaps.ravel(),
+        }
+    )
+    weight_frame = pd.DataFrame(
+        {
+            entity: np.repeat(donors, len(outcomes)),
+            "independent variable": np.tile(outcomes, len(donors)),
+            "weight": weights.ravel(),
+        }
+    )
+    p_value_frame = pd.DataFrame(
+        {
+            "independent variable": outcomes,
+            "rmspe ratio": ratio,
+            "p-value": p_values,
+            "placebos": len(donors),
+        }
+    )
+    return weight_frame, gap_frame, p_value_frame
@@ -0,0 +1,571 @@
+import argparse
+import io
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from schema import MONTHS
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(ROOT, "00_source_data")
+OFFENSE_TYPE_PATH = os.path.join(SOURCE_DIR, "Crime data", "NIBRS_OFFENSE_TYPE.csv")
+
+# File names of the source data, the generated directory has the layout of
+# 00_source_data
+ARREST_ZIP = "ucr_arrests_monthly_all_crimes_race_sex_1974_2020_dta.zip"
+ARREST_MEMBER = "ucr_arrests_monthly_all_crimes_race_sex_{year}.dta"
+CRIME_DIR = "Crime data"
+AGENCIES_FILE = "agencies.csv"
+OFFENSE_TYPE_FILE = "NIBRS_OFFENSE_TYPE.csv"
+INCIDENT_FILE = "{year}_NIBRS_incident.csv"
+OFFENSE_FILE = "{year}_NIBRS_offense.csv"
+
+STATES = {
+    1: "AL",
+    2: "AK",
+    4: "AZ",
+    5: "AR",
+    6: "CA",
+    8: "CO",
+    9: "CT",
+    10: "DE",
+    11: "DC",
+    12: "FL",
+    13: "GA",
+    15: "HI",
+    16: "ID",
+    17: "IL",
+    18: "IN",
+    19: "IA",
+    20: "KS",
+    21: "KY",
+    22: "LA",
+    23: "ME",
+    24: "MD",
+    25: "MA",
+    26: "MI",
+    27: "MN",
+    28: "MS",
+    29: "MO",
+    30: "MT",
+    31: "NE",
+    32: "NV",
+    33: "NH",
+    34: "NJ",
+    35: "NM",
+    36: "NY",
+    37: "NC",
+    38: "ND",
+    39: "OH",
+    40: "OK",
+    41: "OR",
+    42: "PA",
+    44: "RI",
+    45: "SC",
+    46: "SD",
+    47: "TN",
+    48: "TX",
+    49: "UT",
+    50: "VT",
+    51: "VA",
+    53: "WA",
+    54: "WV",
+    55: "WI",
+    56: "WY",
+}
+# State names as written in the state column of the arrest files
+STATE_NAMES = {
+    "AL": "alabama",
+    "AK": "alaska",
+    "AZ": "arizona",
+    "AR": "arkansas",
+    "CA": "california",
+    "CO": "colorado",
+    "CT": "connecticut",
+    "DE": "delaware",
+    "DC": "district of columbia",
+    "FL": "florida",
+    "GA": "georgia",
+    "HI": "hawaii",
+    "ID": "idaho",
+    "IL": "illinois",
+    "IN": "indiana",
+    "IA": "iowa",
+    "KS": "kansas",
+    "KY": "kentucky",
+    "LA": "louisiana",
+    "ME": "maine",
+    "MD": "maryland",
+    "MA": "massachusetts",
+    "MI": "michigan",
+    "MN": "minnesota",
+    "MS": "mississippi",
+    "MO": "missouri",
+    "MT": "montana",
+    "NE": "nebraska",
+    "NV": "nevada",
+    "NH": "new hampshire",
+    "NJ": "new jersey",
+    "NM": "new mexico",
+    "NY": "new york",
+    "NC": "north carolina",
+    "ND": "north dakota",
+    "OH": "ohio",
+    "OK": "oklahoma",
+    "OR": "oregon",
+    "PA": "pennsylvania",
+    "RI": "rhode island",
+    "SC": "south carolina",
+    "SD": "south dakota",
+    "TN": "tennessee",
+    "TX": "texas",
+    "UT": "utah",
+    "VT": "vermont",
+    "VA": "virginia",
+    "WA": "washington",
+    "WV": "west virginia",
+    "WI": "wisconsin",
+    "WY": "wyoming",
+}
+STUDY_COUNTIES = ["08031", "08059", "08005", "08001", "08014", "08035", "08013"]
+
+# Offenses of the UCR arrest files with their mean monthly arrests per
+# 100,000 people
+ARREST_OFFENSES = {
+    "agg_assault_tot": 10.0,
+    "all_other_tot": 80.0,
+    "arson_tot": 0.25,
+    "burglary_tot": 5.0,
+    "curfew_loiter_tot": 0.5,
+    "disorder_cond_tot": 9.0,
+    "drunkenness_tot": 10.0,
+    "dui_tot": 10.0,
+    "embezzlement_tot": 0.4,
+    "family_off_tot": 2.0,
+    "forgery_tot": 1.0,
+    "fraud_tot": 2.0,
+    "gamble_total_tot": 0.1,
+    "liquor_tot": 5.0,
+    "manslaught_neg_tot": 0.02,
+    "mtr_veh_theft_tot": 2.0,
+    "murder_tot": 0.3,
+    "oth_assault_tot": 28.0,
+    "oth_sex_off_tot": 1.2,
+    "poss_cannabis_tot": 5.0,
+    "poss_drug_total_tot": 10.0,
+    "poss_heroin_coke_tot": 2.0,
+    "poss_other_drug_tot": 2.0,
+    "poss_synth_narc_tot": 1.0,
+    "prostitution_tot": 0.6,
+    "rape_tot": 0.6,
+    "robbery_tot": 2.0,
+    "runaways_tot": 0.5,
+    "sale_drug_total_tot": 2.0,
+    "stolen_prop_tot": 2.5,
+    "suspicion_tot": 0.02,
+    "theft_tot": 25.0,
+    "vagrancy_tot": 0.6,
+    "vandalism_tot": 6.0,
+    "weapons_tot": 4.0,
+}
+ARREST_DEMOGRAPHICS = [
+    "arrests",
+    "black",
+    "white",
+    "asian",
+    "amer_ind",
+    "male",
+    "female",
+]
+RACE_SHARES = {"white": 0.68, "black": 0.27, "asian": 0.015, "amer_ind": 0.025}
+MALE_SHARE = 0.78
+
+# Share of the NIBRS offenses in every offense category, split evenly over
+# the offense types of a category; other categories get DEFAULT_WEIGHT
+CATEGORY_WEIGHTS = {
+    "Larceny/Theft Offenses": 30.0,
+    "Assault Offenses": 20.0,
+    "Destruction/Damage/Vandalism of Property": 10.0,
+    "Drug/Narcotic Offenses": 10.0,
+    "Fraud Offenses": 6.0,
+    "Burglary/Breaking & Entering": 5.0,
+    "Motor Vehicle Theft": 4.0,
+    "Weapon Law Violations": 2.0,
+    "Stolen Property Offenses": 1.5,
+    "Robbery": 1.5,
+    "Counterfeiting/Forgery": 1.0,
+    "Sex Offenses": 1.0,
+}
+DEFAULT_WEIGHT = 0.2
+# Probability that an incident has no further offense, most incidents have
+# one offense and NIBRS records at most 10
+MULTI_OFFENSE_P = 0.9
+MAX_OFFENSES = 10
+
+# Dataset sizes used by benchmark.py; "national" is every county and year of
+# the arrest archive
+SCALES = {
+    "study": {
+        "counties": len(STUDY_COUNTIES),
+        "years": (2019, 2020),
+        "agencies_per_county": 6,
+        "nibrs_years": (2019, 2020),
+        "incidents_per_year": 50_000,
+    },
+    "regional": {
+        "counties": 300,
+        "years": tuple(range(2011, 2021)),
+        "agencies_per_county": 6,
+        "nibrs_years": (2019, 2020),
+        "incidents_per_year": 500_000,
+    },
+    "national": {
+        "counties": 3_100,
+        "years": tuple(range(1974, 2021)),
+        "agencies_per_county": 6,
+        "nibrs_years": (2019, 2020),
+        "incidents_per_year": 6_000_000,
+    },
+}
+
+
+def county_codes(n_counties):
+    """
+    County FIPS codes: the study counties first, then odd county numbers
+    spread over every state, the way real county codes are numbered.
+
+    :param n_counties: number of counties
+    :return: list of 5 character FIPS codes
+    """
+    codes = dict.fromkeys(STUDY_COUNTIES)
+    states = list(STATES)
+    i = 0
+    while len(codes) < n_counties:
+        state = states[i % len(states)]
+        codes.setdefault(f"{state:02d}{2 * (i // len(states)) + 1:03d}")
+        i += 1
+    return list(codes)[:n_counties]
+
+
+def agency_frame(counties, agencies_per_county=6, seed=0):
+    """
+    Reporting agencies of every county with a UCR ORI, a NIBRS AGENCY_ID, a
+    place code and a population. The Denver field office of the Secret
+    Service is added without a county, as in the real arrest data.
+
+    :param counties: county FIPS codes, see county_codes
+    :param agencies_per_county: number of agencies per county
+    :param seed: random seed
+    :return: one row per agency
+    """
+    rng = np.random.default_rng(seed)
+    county = np.repeat(np.asarray(counties), agencies_per_county)
+    number = np.tile(np.arange(agencies_per_county), len(counties))
+    state = pd.Series(county).str[:2].astype(int).map(STATES).to_numpy()
+    df = pd.DataFrame(
+        {
+            "ori": [
+                f"{s}{int(c[2:]):03d}{n:02d}" for s, c, n in zip(state, county, number)
+            ],
+            "agency_name": [f"agency {c}-{n}" for c, n in zip(county, number)],
+            "state_abb": state,
+            "fips_state_county_code": county,
+            "fips_place_code": [f"{(n + 1) * 1000:05d}" for n in number],
+            "population": np.clip(
+                rng.lognormal(np.log(20_000), 1.3, len(county)), 500, 4_000_000
+            ).astype(np.int64),
+        }
+    )
+    if "08031" in counties:
+        df.loc[len(df)] = ["CODUSS0", "us secret service, denve", "CO", "", "", 0]
+    df["AGENCY_ID"] = np.arange(1_000, 1_000 + len(df))
+    return df
+
+
+def arrest_frame(agencies, year, seed=0):
+    """
+    Monthly arrest counts of every agency in one year, with the columns of
+    the UCR arrest files: the 14 label columns from ori to population, then
+    "<offense>_<demographic>" counts for every offense of ARREST_OFFENSES
+    and every demographic of ARREST_DEMOGRAPHICS. Agencies report every
+    month, and the other label columns of the real files are left out.
+
+    :param agencies: agencies from agency_frame
+    :param year: year of the data
+    :param seed: random seed, combined with the year
+    :return: one row per agency and month
+    """
+    rng = np.random.default_rng([seed, year])
+    n_rows = len(agencies) * len(MONTHS)
+    agency = np.repeat(np.arange(len(agencies)), len(MONTHS))
+    month = np.tile(np.arange(len(MONTHS)), len(agencies))
+
+    # Slow population growth and a seasonal cycle that peaks in summer
+    population = np.round(
+        agencies["population"].to_numpy()[agency] * 1.01 ** (year - 2000)
+    ).astype(np.int32)
+    season = 1 + 0.1 * np.sin(2 * np.pi * (month - 3) / len(MONTHS))
+    rates = np.array(list(ARREST_OFFENSES.values()))
+    lam = (population * season / 100_000)[:, None] * rates
+    arrests = rng.poisson(lam)
+
+    male = rng.binomial(arrests, MALE_SHARE)
+    shares = list(RACE_SHARES.values())
+    race = rng.multinomial(arrests, shares + [1 - sum(shares)])
+    counts = {
+        "arrests": arrests,
+        "male": male,
+        "female": arrests - male,
+        **{name: race[..., i] for i, name in enumerate(RACE_SHARES)},
+    }
+    block = np.stack([counts[demo] for demo in ARREST_DEMOGRAPHICS], axis=-1)
+    columns = [
+        offense + "_" + demo
+        for offense in ARREST_OFFENSES
+        for demo in ARREST_DEMOGRAPHICS
+    ]
+
+    fips = agencies["fips_state_county_code"].to_numpy()[agency]
+    labels = pd.DataFrame(
+        {
+            "ori": agencies["ori"].to_numpy()[agency],
+            "ori9": agencies["ori"].to_numpy()[agency] + "00",
+            "agency_name": agencies["agency_name"].to_numpy()[agency],
+            "state": agencies["state_abb"].map(STATE_NAMES).to_numpy()[agency],
+            "state_abb": agencies["state_abb"].to_numpy()[agency],
+            "year": np.full(n_rows, year, dtype=np.int16),
+            "month": np.asarray(MONTHS)[month],
+            "date": pd.to_datetime(
+                {"year": np.full(n_rows, year), "month": month + 1, "day": 1}
+            ),
+            "number_of_months_reported": np.full(n_rows, 12, dtype=np.int8),
+            "fips_state_code": pd.Series(fips).str[:2].to_numpy(),
+            "fips_county_code": pd.Series(fips).str[2:].to_numpy(),
+            "fips_state_county_code": fips,
+            "fips_place_code": agencies["fips_place_code"].to_numpy()[agency],
+            "population": population,
+        }
+    )
+    counts = pd.DataFrame(block.reshape(n_rows, -1).astype(np.int16), columns=columns)
+    return pd.concat([labels, counts], axis=1)
+
+
+def write_arrest_zip(path, agencies, years, seed=0):
+    """
+    Write the arrest zip with one Stata member per year. Every year is
+    generated and written on its own, so memory follows one year of data.
+
+    :param path: zip file to write
+    :param agencies: agencies from agency_frame
+    :param years: years to write
+    :param seed: random seed
+    """
+    with ZipFile(path, "w", ZIP_DEFLATED, compresslevel=1) as zip_file:
+        for year in years:
+            buffer = io.BytesIO()
+            arrest_frame(agencies, year, seed).to_stata(buffer, write_index=False)
+            zip_file.writestr(ARREST_MEMBER.format(year=year), buffer.getvalue())
+
+
+def offense_type_weights(offense_type):
+    """
+
+    :param offense_type: the NIBRS_OFFENSE_TYPE table
+    :return: probability of every offense type, see CATEGORY_WEIGHTS
+    """
+    category = offense_type["OFFENSE_CATEGORY_NAME"]
+    weights = category.map(CATEGORY_WEIGHTS).fillna(DEFAULT_WEIGHT)
+    weights = weights / category.map(category.value_counts())
+    return (weights / weights.sum()).to_numpy()
+
+
+def nibrs_agencies(agencies, year):
+    """
+
+    :param agencies: agencies from agency_frame
+    :param year: DATA_YEAR of the rows
+    :return: the agencies in the columns of the NIBRS agencies table
+    """
+    return pd.DataFrame(
+        {
+            "YEARLY_AGENCY_ID": agencies["AGENCY_ID"] * 10_000 + year,
+            "AGENCY_ID": agencies["AGENCY_ID"],
+            "DATA_YEAR": year,
+            "ORI": agencies["ori"] + "00",
+            "UCR_AGENCY_NAME": agencies["agency_name"].str.upper(),
+            "STATE_ABBR": agencies["state_abb"],
+            "POPULATION": agencies["population"],
+            "COUNTY_NAME": "COUNTY " + agencies["fips_state_county_code"],
+        }
+    )
+
+
+def nibrs_frames(agencies, year, n_incidents, offense_type, seed=0):
+    """
+    Incidents and offenses of one year in the columns of the NIBRS incident
+    and offense tables. Incidents are spread over the agencies in proportion
+    to their population, and every incident has a geometric number of
+    offenses.
+
+    :param agencies: agencies from agency_frame
+    :param year: DATA_YEAR of the rows
+    :param n_incidents: number of incidents
+    :param offense_type: the NIBRS_OFFENSE_TYPE table
+    :param seed: random seed, combined with the year
+    :return: (incidents, offenses)
+    """
+    rng = np.random.default_rng([seed, year, 1])
+    weights = agencies["population"].to_numpy(dtype=float) + 1
+    agency = rng.choice(len(agencies), n_incidents, p=weights / weights.sum())
+
+    # Format every day of the year once, as in "05-JAN-19"
+    days = np.arange(np.datetime64(f"{year}-01-01"), np.datetime64(f"{year + 1}-01-01"))
+    labels = pd.DatetimeIndex(days).strftime("%d-%b-%y").str.upper().to_numpy()
+    month = days.astype("datetime64[M]").astype(np.int64) % 12
+    day = rng.integers(0, len(days), n_incidents)
+
+    incident_ids = year * 1_000_000_000 + np.arange(n_incidents)
+    incidents = pd.DataFrame(
+        {
+            "DATA_YEAR": year,
+            "AGENCY_ID": agencies["AGENCY_ID"].to_numpy()[agency],
+            "INCIDENT_ID": incident_ids,
+            "NIBRS_MONTH_ID": year * 1_000_000 + agency * 12 + month[day],
+            "CARGO_THEFT_FLAG": "",
+            "INCIDENT_DATE": labels[day],
+            "INCIDENT_HOUR": rng.integers(0, 24, n_incidents),
+        }
+    )
+
+    n_offenses = np.minimum(rng.geometric(MULTI_OFFENSE_P, n_incidents), MAX_OFFENSES)
+    incident = np.repeat(np.arange(n_incidents), n_offenses)
+    offenses = pd.DataFrame(
+        {
+            "DATA_YEAR": year,
+            "OFFENSE_ID": year * 1_000_000_000 + np.arange(len(incident)),
+            "INCIDENT_ID": incident_ids[incident],
+            "OFFENSE_TYPE_ID": rng.choice(
+                offense_type["OFFENSE_TYPE_ID"].to_numpy(),
+                len(incident),
+                p=offense_type_weights(offense_type),
+            ),
+            "ATTEMPT_COMPLETE_FLAG": np.where(
+                rng.random(len(incident)) < 0.03, "A", "C"
+            ),
+            "LOCATION_ID": rng.integers(1, 59, len(incident)),
+        }
+    )
+    return incidents, offenses
+
+
+def write_dataset(
+    directory,
+    counties=len(STUDY_COUNTIES),
+    years=(2019, 2020),
+    agencies_per_county=6,
+    nibrs_years=(2019, 2020),
+    incidents_per_year=50_000,
+    seed=0,
+    overwrite=False,
+):
+    """
+    Write a synthetic copy of 00_source_data: the arrest zip, the NIBRS
+    agencies and offense type tables and the incidents and offenses of
+    every NIBRS year. The real 00_source_data of the repository is only
+    written to with overwrite, before anything else is written.
+
+    :param directory: output directory, created if needed
+    :param counties: number of counties, see county_codes
+    :param years: years of the arrest zip
+    :param agencies_per_county: number of agencies per county
+    :param nibrs_years: years of the NIBRS tables
+    :param incidents_per_year: number of NIBRS incidents per year
+    :param seed: random seed
+    :param overwrite: allow directory to be the repository's 00_source_data
+    :return: {name: path} of the written files
+    """
+    if (
+        not overwrite
+        and os.path.exists(directory)
+        and os.path.samefile(directory, SOURCE_DIR)
+    ):
+        raise ValueError(
+            f"{directory} holds the real source data, pass overwrite to replace it"
+        )
+    crime_dir = os.path.join(directory, CRIME_DIR)
+    os.makedirs(crime_dir, exist_ok=True)
+    agencies = agency_frame(county_codes(counties), agencies_per_county, seed)
+    offense_type = pd.read_csv(OFFENSE_TYPE_PATH)
+
+    paths = {
+        "arrests": os.path.join(directory, ARREST_ZIP),
+        "agencies": os.path.join(crime_dir, AGENCIES_FILE),
+        "offense_type": os.path.join(crime_dir, OFFENSE_TYPE_FILE),
+    }
+    write_arrest_zip(paths["arrests"], agencies, years, seed)
+    nibrs_agencies(agencies, min(nibrs_years)).to_csv(paths["agencies"], index=False)
+    # Written into 00_source_data itself, the offense types are already there
+    if not (
+        os.path.exists(paths["offense_type"])
+        and os.path.samefile(OFFENSE_TYPE_PATH, paths["offense_type"])
+    ):
+        shutil.copyfile(OFFENSE_TYPE_PATH, paths["offense_type"])
+
+    for year in nibrs_years:
+        incidents, offenses = nibrs_frames(
+            agencies, year, incidents_per_year, offense_type, seed
+        )
+        paths[f"incidents_{year}"] = os.path.join(
+            crime_dir, INCIDENT_FILE.format(year=year)
+        )
+        paths[f"offenses_{year}"] = os.path.join(
+            crime_dir, OFFENSE_FILE.format(year=year)
+        )
+        incidents.to_csv(paths[f"incidents_{year}"], index=False)
+        offenses.to_csv(paths[f"offenses_{year}"], index=False)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write synthetic UCR arrest and NIBRS data"
+    )
+    parser.add_argument("directory", help="output directory")
+    parser.add_argument("--scale", choices=list(SCALES), default="study")
+    parser.add_argument("--counties", type=int)
+    parser.add_argument("--years", type=int, nargs=2, metavar=("FIRST", "LAST"))
+    parser.add_argument("--agencies-per-county", type=int)
+    parser.add_argument("--incidents-per-year", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="allow writing into the repository's 00_source_data",
+    )
+    args = parser.parse_args()
+
+    options = dict(SCALES[args.scale])
+    if args.counties is not None:
+        options["counties"] = args.counties
+    if args.years is not None:
+        options["years"] = tuple(range(args.years[0], args.years[1] + 1))
+    if args.agencies_per_county is not None:
+        options["agencies_per_county"] = args.agencies_per_county
+    if args.incidents_per_year is not None:
+        options["incidents_per_year"] = args.incidents_per_year
+
+    if (
+        not args.overwrite
+        and os.path.exists(args.directory)
+        and os.path.samefile(args.directory, SOURCE_DIR)
+    ):
+        parser.error(f"{args.directory} holds the real source data, see --overwrite")
+    paths = write_dataset(
+        args.directory, seed=args.seed, overwrite=args.overwrite, **options
+    )
+    for name, path in paths.items():
+        print(f"{name}: {path}")